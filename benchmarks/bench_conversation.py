@@ -0,0 +1,172 @@
+"""Drive the reservation conversation end to end against a stubbed Bot API, without network."""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+from telegram.request import BaseRequest, RequestData
+
+from bot import InstrumentedBot
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'bench_bot'}
+
+
+class StubRequest(BaseRequest):
+    """Answer every Bot API call locally with a minimal successful response."""
+
+    def __init__(self):
+        self.calls = {}
+        self._message_id = 1000
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data:RequestData=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == 'getMe':
+            result = BOT_USER
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            result = {
+                'message_id': parameters.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': parameters.get('chat_id'), 'type': 'private'},
+                'from': BOT_USER,
+                'text': parameters.get('text', ''),
+            }
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+
+class Conversation:
+    """Builds the update payloads of one user going through a reservation."""
+
+    def __init__(self, user_id:int):
+        self.user_id = user_id
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'last_name': 'User', 'username': f"bench{user_id}"}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.update_id = user_id * 1000
+        self.message_id = 0
+
+    def _next_ids(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    def message(self, text=None, **fields):
+        update_id, message_id = self._next_ids()
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': self.chat, 'from': self.user, **fields}
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, data):
+        update_id, message_id = self._next_ids()
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': self.chat, 'from': BOT_USER, 'text': '...'}
+        return {'update_id': update_id, 'callback_query': {'id': str(update_id), 'from': self.user, 'chat_instance': str(self.user_id), 'message': message, 'data': data}}
+
+    def reservation_flow(self, pickup_timestamp_ms:int, bike_id:int):
+        """Return the updates of a complete reservation, in order."""
+        return [
+            self.message('/res'),
+            self.callback('new_reservation'),
+            self.callback('choose_pickup_time'),
+            self.message(web_app_data={'data': f"{pickup_timestamp_ms}_0", 'button_text': 'Select Pickup Time'}),
+            self.callback('choose_duration'),
+            self.callback('duration_1 hour'),
+            self.callback('choose_bike'),
+            self.callback(f"bike_{bike_id}"),
+            self.callback('choose_association'),
+            self.message('Bench association'),
+            self.callback('set_email'),
+            self.message('bench@example.org'),
+            self.callback('validate_reservation'),
+        ]
+
+
+async def run_conversations(users:int):
+    """Run one reservation per user concurrently and return timing results.
+
+    Updates go through the application's update queue, as they do in production, and
+    each user sends their next update once the previous one was handled. Update
+    latency is measured from the queue to the end of handling.
+
+    Raises RuntimeError if a handler raised or a user did not end up with exactly
+    one stored reservation, so a broken conversation cannot report a throughput.
+    """
+    import main
+
+    request = StubRequest()
+    application = main.build_application(
+        Application.builder().bot(InstrumentedBot('123456:BENCH', request=request, get_updates_request=StubRequest())).updater(None)
+    )
+    errors = []
+    handled = {}
+
+    async def record_error(update, context):
+        errors.append(context.error)
+
+    async def record_handled(update, context):
+        handled.pop(update.update_id).set_result(time.perf_counter())
+
+    application.add_error_handler(record_error)
+    # Runs after every other group, once the update is handled
+    application.add_handler(TypeHandler(Update, record_handled), group=100)
+    bikes = await main.bike_storage.list_bikes()
+    await application.initialize()
+    await application.start()
+    durations = []
+
+    async def run_user(n):
+        conversation = Conversation(100000 + n)
+        loop = asyncio.get_running_loop()
+        # Spread users over hours and bikes so every booking succeeds
+        pickup_ms = int((time.time() // 3600 + 24 + n // len(bikes)) * 3600 * 1000)
+        for payload in conversation.reservation_flow(pickup_ms, bikes[n % len(bikes)]['bike_id']):
+            done = handled[payload['update_id']] = loop.create_future()
+            started = time.perf_counter()
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+            durations.append(await done - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(n) for n in range(users)))
+    await application.update_queue.join()
+    elapsed = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+
+    if errors:
+        raise RuntimeError(f"{len(errors)} handler errors, the first one: {errors[0]!r}") from errors[0]
+    for n in range(users):
+        reservations = await main.reservation_storage.list_reservations_for_user(100000 + n)
+        if len(reservations) != 1:
+            raise RuntimeError(f"User {100000 + n} has {len(reservations)} reservations instead of 1")
+
+    durations.sort()
+    return {
+        'users': users,
+        'updates': len(durations),
+        'seconds': elapsed,
+        'reservations_per_second': users / elapsed,
+        'update_p50_seconds': durations[len(durations) // 2],
+        'update_p99_seconds': durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+        'bot_api_calls': request.calls,
+        'metrics': main.metrics.render(),
+    }
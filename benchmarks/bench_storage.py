@@ -0,0 +1,103 @@
+"""Time every public storage method against synthetic CSV files of a given size."""
+import csv
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../src'))
+
+from storage import ReservationStorage, IndexedReservationStorage, BikeStorage, UserStorage, RESERVATION_FIELDS, USER_FIELDS
+from sqlite_storage import SQLiteDatabase, SQLiteReservationStorage, SQLiteBikeStorage, SQLiteUserStorage, import_csv
+
+START = datetime(2024, 1, 1, 8)
+MIN_SECONDS = 0.2  # keep calling a method until this much time has passed
+MAX_CALLS = 1000
+
+
+def generate(directory, rows, seed=0):
+    """Write reservations.csv, users.csv and bikes.csv with `rows` reservations and users."""
+    rng = random.Random(seed)
+    bike_ids = [1000 * (i + 1) for i in range(max(5, rows // 1000))]
+    with open(os.path.join(directory, 'bikes.csv'), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['bike_id', 'size', 'name'])
+        writer.writerows([bike_id, rng.choice(['medium', 'large']), f"Bike {bike_id}"] for bike_id in bike_ids)
+    with open(os.path.join(directory, 'users.csv'), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(USER_FIELDS)
+        writer.writerows([user_id, f"user{user_id}", "First", "Last", f"Association {user_id % 50}", f"user{user_id}@example.org"] for user_id in range(1, rows + 1))
+    reservation_ids = []
+    with open(os.path.join(directory, 'reservations.csv'), 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(RESERVATION_FIELDS)
+        for n in range(rows):
+            reservation_id = rng.getrandbits(64)
+            reservation_ids.append(reservation_id)
+            user_id = rng.randint(1, max(1, rows // 10))
+            start = START + timedelta(hours=n)
+            writer.writerow([reservation_id, user_id, f"user{user_id}", "First", "Last", f"Association {user_id % 50}", f"user{user_id}@example.org",
+                             rng.choice(bike_ids), start, start + timedelta(hours=rng.choice([1, 3, 5])), 'accepted'])
+    return reservation_ids, bike_ids
+
+
+def measure(function):
+    """Return the mean duration of function() in seconds."""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SECONDS or calls >= MAX_CALLS:
+            return elapsed / calls, calls
+
+
+def storages(directory):
+    """Yield (backend, reservation_storage, bike_storage, user_storage) for every backend."""
+    yield 'csv', ReservationStorage(os.path.join(directory, 'reservations.csv')), BikeStorage(os.path.join(directory, 'bikes.csv')), UserStorage(os.path.join(directory, 'users.csv'))
+    yield 'csv-indexed', IndexedReservationStorage(os.path.join(directory, 'reservations.csv')), BikeStorage(os.path.join(directory, 'bikes.csv')), UserStorage(os.path.join(directory, 'users.csv'))
+    database = SQLiteDatabase(os.path.join(directory, 'bench.db'))
+    import_csv(database, directory)
+    yield 'sqlite', SQLiteReservationStorage(database), SQLiteBikeStorage(database), SQLiteUserStorage(database)
+
+
+def run(directory, rows):
+    """Benchmark all backends at one size and return a list of result dicts."""
+    reservation_ids, bike_ids = generate(directory, rows)
+    rng = random.Random(1)
+    results = []
+    for backend, reservations, bikes, users in storages(directory):
+        started = START + timedelta(hours=rows + 1)
+        calls = {
+            ('ReservationStorage', 'add_reservation'): lambda: reservations.add_reservation(1, 'user1', 'First', 'Last', 'Association 1', 'user1@example.org', bike_ids[0], started, started + timedelta(hours=1), 'accepted'),
+            ('ReservationStorage', 'get_reservation_by_id'): lambda: reservations.get_reservation_by_id(rng.choice(reservation_ids)),
+            ('ReservationStorage', 'list_reservations'): lambda: reservations.list_reservations(),
+            ('ReservationStorage', 'iter_reservations'): lambda: deque(reservations.iter_reservations(), maxlen=0),
+            ('ReservationStorage', 'list_reservations_for_user'): lambda: reservations.list_reservations_for_user(rng.randint(1, max(1, rows // 10))),
+            ('ReservationStorage', 'list_reservations_for_user_page'): lambda: reservations.list_reservations_for_user_page(rng.randint(1, max(1, rows // 10)), 8),
+            ('ReservationStorage', 'update_statuses'): lambda: reservations.update_statuses({rng.choice(reservation_ids): rng.choice(['accepted', 'pending'])}),
+            ('BikeStorage', 'add_bike'): lambda: bikes.add_bike(rng.getrandbits(31), 'medium', 'Bench bike'),
+            ('BikeStorage', 'get_bike_by_id'): lambda: bikes.get_bike_by_id(rng.choice(bike_ids)),
+            ('BikeStorage', 'list_bikes'): lambda: bikes.list_bikes(),
+            ('UserStorage', 'add_user'): lambda: users.add_user(rows + rng.randint(1, rows), 'new', 'First', 'Last', 'Association', 'new@example.org'),
+            ('UserStorage', 'update_user'): lambda: users.update_user(rng.randint(1, rows), 'user', 'First', 'Last', 'Association', 'user@example.org'),
+            ('UserStorage', 'get_user_by_id'): lambda: users.get_user_by_id(rng.randint(1, rows)),
+            ('UserStorage', 'list_users'): lambda: users.list_users(),
+        }
+        if hasattr(users, 'compact'):
+            # Only the CSV journal needs compacting
+            calls[('UserStorage', 'compact')] = users.compact
+        for (storage_class, method), function in calls.items():
+            seconds, count = measure(function)
+            results.append({
+                'backend': backend,
+                'class': storage_class,
+                'method': method,
+                'rows': rows,
+                'calls': count,
+                'mean_seconds': seconds,
+            })
+    return results
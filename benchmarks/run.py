@@ -0,0 +1,76 @@
+"""Run the benchmark suite and print the results as JSON.
+
+Usage:
+    python benchmarks/run.py --sizes 1000,100000,1000000 --output bench.json
+
+Compare two result files to spot regressions between commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import bench_storage
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,100000,1000000', help="comma separated numbers of reservation/user rows")
+    parser.add_argument('--users', type=int, default=50, help="concurrent users in the conversation benchmark")
+    parser.add_argument('--skip-storage', action='store_true')
+    parser.add_argument('--skip-conversation', action='store_true')
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'storage': [],
+        'conversation': None,
+    }
+
+    if not args.skip_storage:
+        for rows in (int(size) for size in args.sizes.split(',')):
+            directory = tempfile.mkdtemp(prefix=f"bench-{rows}-")
+            try:
+                print(f"Benchmarking storage with {rows} rows...", file=sys.stderr)
+                results['storage'].extend(bench_storage.run(directory, rows))
+            finally:
+                shutil.rmtree(directory)
+
+    if not args.skip_conversation:
+        directory = tempfile.mkdtemp(prefix='bench-conversation-')
+        try:
+            # main opens its storage from STORAGE_DIR, which must be set before it is imported
+            bench_storage.generate(directory, 1000)
+            os.environ['STORAGE_DIR'] = directory
+            os.environ['STORAGE_BACKEND'] = 'csv'
+            import bench_conversation
+            print(f"Benchmarking the conversation with {args.users} users...", file=sys.stderr)
+            results['conversation'] = asyncio.run(bench_conversation.run_conversations(args.users))
+        finally:
+            shutil.rmtree(directory)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+
+from metrics import metrics
+from startup import LazyInit
+
+
+class AsyncStorage:
+    """Awaitable facade over a synchronous storage object.
+
+    Every method call is run on the given executor, so the event loop never waits on
+    disk, and its duration is recorded under ``name``. Attributes that are not
+    callable are returned as is. If the storage is a LazyInit that is still being
+    built, calls first wait for it without holding a storage thread.
+    """
+
+    def __init__(self, storage, executor:Executor, name:str=None):
+        self.storage = storage
+        self.executor = executor
+        self.name = name or type(storage).__name__
+
+    def _target(self):
+        return self.storage.get() if isinstance(self.storage, LazyInit) else self.storage
+
+    def __getattr__(self, name):
+        pending = isinstance(self.storage, LazyInit) and not self.storage.ready()
+        if not pending:
+            attribute = getattr(self._target(), name)
+            if not callable(attribute):
+                return attribute
+
+        def timed_call(*args, **kwargs):
+            method = getattr(self._target(), name) if pending else attribute
+            with metrics.timed('bot_storage_seconds', storage=self.name, method=name):
+                return method(*args, **kwargs)
+
+        async def call(*args, **kwargs):
+            if pending:
+                await asyncio.wrap_future(self.storage.future)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(timed_call, *args, **kwargs))
+
+        if not pending:
+            call = functools.wraps(attribute)(call)
+        return call
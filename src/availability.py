@@ -0,0 +1,198 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime
+
+from idempotency import IdempotencyCache
+from sqlite_storage import SQLiteDatabase, to_sql_id
+
+# Reservations in these states no longer hold their bike
+RELEASED_STATUSES = {'canceled', 'cancelled', 'rejected'}
+
+
+class _Unavailable(Exception):
+    """A conflict inside an idempotent reserve; the cache forgets failed calls."""
+
+
+def _reserve_once(availability, idempotency_key:str, *args):
+    """Run availability.reserve once per key. Only bookings are remembered, so after a
+    conflict the same key can still book another bike or time slot."""
+    def reserve():
+        reservation_id = availability.reserve(*args)
+        if reservation_id is None:
+            raise _Unavailable
+        return reservation_id
+    try:
+        return availability.idempotency.call(idempotency_key, reserve)
+    except _Unavailable:
+        return None
+
+
+class BikeAvailability:
+    """Per-bike interval index over the reservations of a ReservationStorage.
+
+    For every bike the booked ``[start_datetime, end_datetime)`` intervals are kept
+    sorted by start, together with the running maximum of their end times, so
+    "is bike X free in [a, b)" is a single binary search. A replayed ``reserve`` with
+    the same ``idempotency_key`` returns the first reservation's ID instead of
+    reporting a conflict with it.
+    """
+
+    def __init__(self, reservation_storage):
+        self.reservation_storage = reservation_storage
+        self.idempotency = IdempotencyCache()
+        self.lock = threading.Lock()
+        self._starts = defaultdict(list)
+        self._reach = defaultdict(list)  # _reach[bike][i] = max end of intervals 0..i
+        self._load()
+
+    def _load(self):
+        """Build the interval index from the reservation storage."""
+        with self.lock:
+            self._starts.clear()
+            self._reach.clear()
+            for reservation in self.reservation_storage.list_reservations():
+                if reservation['status'] not in RELEASED_STATUSES:
+                    self._insert(reservation['bike_id'], reservation['start_datetime'], reservation['end_datetime'])
+
+    def _insert(self, bike_id:int, start:datetime, end:datetime):
+        starts = self._starts[bike_id]
+        reach = self._reach[bike_id]
+        i = bisect_left(starts, start)
+        value = max(reach[i - 1], end) if i > 0 else end
+        starts.insert(i, start)
+        reach.insert(i, value)
+        # Propagate the new end to later intervals; stops as soon as they already reach further
+        for j in range(i + 1, len(reach)):
+            if reach[j] >= value:
+                break
+            reach[j] = value
+
+    def _is_free(self, bike_id:int, start:datetime, end:datetime):
+        starts = self._starts.get(bike_id)
+        if not starts:
+            return True
+        # Intervals starting before `end` overlap iff one of them ends after `start`
+        i = bisect_left(starts, end)
+        return i == 0 or self._reach[bike_id][i - 1] <= start
+
+    def is_available(self, bike_id:int, start:datetime, end:datetime):
+        """Return True if the bike has no reservation overlapping [start, end)."""
+        with self.lock:
+            return self._is_free(bike_id, start, end)
+
+    def available_bikes(self, bike_ids, start:datetime, end:datetime):
+        """Return the subset of bike_ids that are free in [start, end), keeping their order."""
+        with self.lock:
+            return [bike_id for bike_id in bike_ids if self._is_free(bike_id, start, end)]
+
+    def reserve(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending', idempotency_key:str=None):
+        """Save the reservation if the bike is free, returning its ID, or None on conflict."""
+        if idempotency_key is not None:
+            return _reserve_once(self, idempotency_key, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        with self.lock:
+            if not self._is_free(bike_id, start_datetime, end_datetime):
+                return None
+            reservation_id, written = self.reservation_storage.submit_reservation(user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+            if status not in RELEASED_STATUSES:
+                self._insert(bike_id, start_datetime, end_datetime)
+        # Wait for the flush outside the lock, so concurrent bookings share it
+        try:
+            written.result()
+        except BaseException:
+            # Free the interval again; the row never reached the storage
+            self._load()
+            raise
+        return reservation_id
+
+
+CLAIMS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS claims (
+    claim_id INTEGER PRIMARY KEY,
+    reservation_id INTEGER,
+    bike_id INTEGER NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS claims_bike_id ON claims (bike_id, end_datetime);
+CREATE INDEX IF NOT EXISTS claims_end_datetime ON claims (end_datetime);
+"""
+
+# Only intervals ending after the queried start can overlap, so the end indexes keep
+# these queries to current and future claims
+SELECT_BIKE_CONFLICT = "SELECT 1 FROM claims WHERE bike_id = ? AND end_datetime > ? AND start_datetime < ? LIMIT 1"
+SELECT_BUSY_BIKES = "SELECT DISTINCT bike_id FROM claims WHERE end_datetime > ? AND start_datetime < ?"
+INSERT_CLAIM = "INSERT INTO claims (reservation_id, bike_id, start_datetime, end_datetime) VALUES (?, ?, ?, ?)"
+SET_CLAIM_RESERVATION = "UPDATE claims SET reservation_id = ? WHERE claim_id = ?"
+DELETE_CLAIM = "DELETE FROM claims WHERE claim_id = ?"
+
+
+class SharedBikeAvailability:
+    """Bike availability kept in a SQLite file shared by several processes.
+
+    Used when reservations are spread over worker processes that each only index
+    their own users: every booked interval is a row of the ``claims`` table, and a
+    claim is only inserted inside an immediate transaction after checking for
+    overlaps, so two processes can never book the same bike for the same time. The
+    claim is committed before the reservation is written, so a crash in between can
+    leave a stale claim but never a double booking; ``rebuild`` clears those.
+    """
+
+    def __init__(self, reservation_storage, filename:str):
+        self.reservation_storage = reservation_storage
+        self.idempotency = IdempotencyCache()
+        self.database = SQLiteDatabase(filename, CLAIMS_SCHEMA)
+
+    def rebuild(self, reservations):
+        """Replace all claims by those of the given reservations."""
+        with self.database.connection() as connection:
+            connection.execute("DELETE FROM claims")
+            connection.executemany(INSERT_CLAIM, (
+                (to_sql_id(r['reservation_id']), r['bike_id'], str(r['start_datetime']), str(r['end_datetime']))
+                for r in reservations if r['status'] not in RELEASED_STATUSES
+            ))
+
+    def is_available(self, bike_id:int, start:datetime, end:datetime):
+        """Return True if the bike has no reservation overlapping [start, end)."""
+        return self.database.connection().execute(SELECT_BIKE_CONFLICT, (bike_id, str(start), str(end))).fetchone() is None
+
+    def available_bikes(self, bike_ids, start:datetime, end:datetime):
+        """Return the subset of bike_ids that are free in [start, end), keeping their order."""
+        busy = {row[0] for row in self.database.connection().execute(SELECT_BUSY_BIKES, (str(start), str(end)))}
+        return [bike_id for bike_id in bike_ids if bike_id not in busy]
+
+    def _claim(self, bike_id:int, start:datetime, end:datetime):
+        """Insert a claim if the bike is free and return its ID, or None on conflict."""
+        connection = self.database.connection()
+        # IMMEDIATE takes the database write lock up front, so the check and the insert are atomic
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute(SELECT_BIKE_CONFLICT, (bike_id, str(start), str(end))).fetchone() is not None:
+                connection.rollback()
+                return None
+            claim_id = connection.execute(INSERT_CLAIM, (None, bike_id, str(start), str(end))).lastrowid
+            connection.commit()
+            return claim_id
+        except BaseException:
+            connection.rollback()
+            raise
+
+    def reserve(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending', idempotency_key:str=None):
+        """Save the reservation if the bike is free, returning its ID, or None on conflict."""
+        if idempotency_key is not None:
+            return _reserve_once(self, idempotency_key, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        if status in RELEASED_STATUSES:
+            return self.reservation_storage.add_reservation(user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        claim_id = self._claim(bike_id, start_datetime, end_datetime)
+        if claim_id is None:
+            return None
+        connection = self.database.connection()
+        try:
+            reservation_id = self.reservation_storage.add_reservation(user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        except BaseException:
+            with connection:
+                connection.execute(DELETE_CLAIM, (claim_id,))
+            raise
+        with connection:
+            connection.execute(SET_CLAIM_RESERVATION, (to_sql_id(reservation_id), claim_id))
+        return reservation_id
@@ -0,0 +1,18 @@
+from telegram.ext import ExtBot
+
+from metrics import metrics
+from outbound import OutboundScheduler
+
+
+class InstrumentedBot(ExtBot):
+    """ExtBot recording the latency of every outbound Bot API request.
+
+    ExtBot._do_post runs the rate limiter, so with an OutboundScheduler the
+    scheduler records the requests itself, apart from the time they were queued.
+    """
+
+    async def _do_post(self, endpoint, *args, **kwargs):
+        if isinstance(self.rate_limiter, OutboundScheduler):
+            return await super()._do_post(endpoint, *args, **kwargs)
+        with metrics.timed('bot_api_seconds', method=endpoint):
+            return await super()._do_post(endpoint, *args, **kwargs)
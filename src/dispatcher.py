@@ -0,0 +1,205 @@
+"""Front dispatcher spreading updates over several bot worker processes.
+
+Updates are received once, through the webhook listener or by polling, and
+forwarded to ``src/main.py`` workers running in local webhook mode. The worker is
+chosen from the user ID, so each user's conversation state always lives in the
+same process; bike availability is shared between the workers through a SQLite
+claims file.
+
+Usage:
+    python src/dispatcher.py --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import subprocess
+import sys
+
+import httpx
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from availability import SharedBikeAvailability
+from storage import ReservationStorage
+from sqlite_storage import SQLiteDatabase, SQLiteReservationStorage
+from webhook import WebhookServer
+
+dirname = os.path.dirname(__file__)
+logger = logging.getLogger(__name__)
+
+# Keeps memory bounded if a worker stops answering
+MAX_QUEUED_UPDATES = 10000
+
+
+def shard_for(user_id:int, workers:int):
+    """Index of the worker serving a user."""
+    return user_id % workers
+
+
+def update_user_id(payload:dict):
+    """Return the ID of the user who sent an update, or 0 if it has none."""
+    for value in payload.values():
+        if isinstance(value, dict):
+            if 'from' in value:
+                return value['from']['id']
+            if 'chat' in value:
+                return value['chat']['id']
+    return 0
+
+
+class Worker:
+    """A bot worker process and the queue of updates forwarded to it, in arrival order."""
+
+    def __init__(self, index:int, count:int, port:int, url_path:str, secret:str):
+        self.index = index
+        self.count = count
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}/{url_path.lstrip('/')}"
+        self.secret = secret
+        self.queue = asyncio.Queue(MAX_QUEUED_UPDATES)
+        self.process = None
+
+    def start(self):
+        env = dict(
+            os.environ,
+            BOT_MODE="webhook",
+            WEBHOOK_LISTEN="127.0.0.1",
+            WEBHOOK_PORT=str(self.port),
+            WEBHOOK_SECRET=self.secret,
+            WORKER_INDEX=str(self.index),
+            WORKER_COUNT=str(self.count),
+        )
+        # Only the dispatcher talks to Telegram about updates
+        env.pop("WEBHOOK_URL", None)
+        self.process = subprocess.Popen([sys.executable, os.path.join(dirname, 'main.py')], env=env)
+        logger.info("Started worker %s (pid %s) on port %s", self.index, self.process.pid, self.port)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+    async def forward(self, client:httpx.AsyncClient):
+        """POST queued updates to the worker one at a time, retrying until it accepts them."""
+        while True:
+            body = await self.queue.get()
+            delay = 0.1
+            while True:
+                if self.process.poll() is not None:
+                    logger.error("Worker %s exited with %s, restarting it", self.index, self.process.returncode)
+                    self.start()
+                try:
+                    response = await client.post(self.url, content=body, headers={'X-Telegram-Bot-Api-Secret-Token': self.secret})
+                except httpx.TransportError:
+                    # Not listening yet, or restarting
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 5)
+                    continue
+                if response.status_code != 200:
+                    logger.warning("Worker %s rejected an update with %s", self.index, response.status_code)
+                break
+
+
+class Dispatcher(WebhookServer):
+    """Webhook listener that forwards each update to the worker owning its user."""
+
+    def __init__(self, workers, listen:str, port:int, url_path:str, secret_token:str=None):
+        super().__init__(None, listen, port, url_path, secret_token)
+        self.workers = workers
+
+    def _deliver(self, payload:dict, body:bytes):
+        self.dispatch(payload, body)
+
+    def dispatch(self, payload:dict, body:bytes=None):
+        worker = self.workers[shard_for(update_user_id(payload), len(self.workers))]
+        try:
+            worker.queue.put_nowait(body if body is not None else json.dumps(payload).encode())
+        except asyncio.QueueFull:
+            logger.error("Dropping update %s, worker %s is not keeping up", payload.get('update_id'), worker.index)
+
+
+def rebuild_availability(storage_dir:str, backend:str, sqlite_path:str=None, availability_path:str=None):
+    """Rebuild the shared claims file from the stored reservations, before the workers start."""
+    if backend == "sqlite":
+        reservation_storage = SQLiteReservationStorage(SQLiteDatabase(sqlite_path or os.path.join(storage_dir, 'bot.db')))
+    else:
+        reservation_storage = ReservationStorage(os.path.join(storage_dir, 'reservations.csv'))
+    availability = SharedBikeAvailability(reservation_storage, availability_path or os.path.join(storage_dir, 'availability.db'))
+    # Archived reservations are all finished, so only the current ones can hold a bike
+    availability.rebuild(reservation_storage.list_reservations())
+
+
+async def poll(dispatcher:Dispatcher, bot_token:str, allowed_updates):
+    """Fetch updates with getUpdates and dispatch them."""
+    async with Bot(bot_token) as bot:
+        await bot.delete_webhook()
+        offset = None
+        delay = 1
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+            except TelegramError as e:
+                # A network blip must not end run() and take the workers down with it
+                logger.warning("getUpdates failed, retrying in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 1
+            for update in updates:
+                dispatcher.dispatch(update.to_dict())
+                offset = update.update_id + 1
+
+
+async def run(workers, mode:str, listen:str, port:int, url_path:str, bot_token:str, webhook_url:str=None, secret_token:str=None, allowed_updates=None):
+    dispatcher = Dispatcher(workers, listen, port, url_path, secret_token)
+    for worker in workers:
+        worker.start()
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            forwarders = [asyncio.create_task(worker.forward(client)) for worker in workers]
+            if mode == "webhook":
+                if webhook_url:
+                    async with Bot(bot_token) as bot:
+                        await bot.set_webhook(webhook_url, allowed_updates=allowed_updates, secret_token=secret_token)
+                await dispatcher.start()
+                try:
+                    await asyncio.gather(*forwarders)
+                finally:
+                    await dispatcher.stop()
+            else:
+                await asyncio.gather(poll(dispatcher, bot_token, allowed_updates), *forwarders)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=int(os.getenv("WORKERS", os.cpu_count() or 1)), help="number of worker processes")
+    parser.add_argument('--worker-port', type=int, default=int(os.getenv("WORKER_PORT", "9000")), help="port of the first worker; the others use the following ports")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    storage_dir = os.getenv("STORAGE_DIR", os.path.join(dirname, '../storage'))
+    rebuild_availability(storage_dir, os.getenv("STORAGE_BACKEND", "csv"), os.getenv("SQLITE_PATH"), os.getenv("AVAILABILITY_DB"))
+
+    url_path = os.getenv("WEBHOOK_PATH", "telegram")
+    worker_secret = secrets.token_urlsafe(32)
+    workers = [Worker(index, args.workers, args.worker_port + index, url_path, worker_secret) for index in range(args.workers)]
+    try:
+        asyncio.run(run(
+            workers,
+            os.getenv("BOT_MODE", "polling"),
+            os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+            int(os.getenv("WEBHOOK_PORT", "8443")),
+            url_path,
+            os.getenv("BOT_TOKEN"),
+            os.getenv("WEBHOOK_URL"),
+            os.getenv("WEBHOOK_SECRET"),
+            [Update.MESSAGE, Update.CALLBACK_QUERY],
+        ))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class IdempotencyCache:
+    """Bounded LRU of recently seen keys, each forgotten ``ttl`` seconds after it was added.
+
+    ``add`` tells whether a key is new, e.g. an update ID. ``call`` runs a function
+    once per key and hands its result to every later or concurrent call with the same
+    key, so replayed writes are no-ops; a call that raises is forgotten and may be
+    retried.
+    """
+
+    def __init__(self, max_size:int=10000, ttl:float=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (added, Future), least recently used first
+
+    def _expire(self, now:float):
+        """Drop entries from the front while they are expired or over max_size."""
+        while self._entries:
+            key, (added, _) = next(iter(self._entries.items()))
+            if now - added < self.ttl and len(self._entries) <= self.max_size:
+                break
+            del self._entries[key]
+
+    def _claim(self, key):
+        """Return (future, True) for a new key, or the existing (future, False)."""
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            # Hits move a key to the end, so older keys may be left behind it by _expire
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1], False
+            self._entries.pop(key, None)
+            future = Future()
+            self._entries[key] = (now, future)
+            self._expire(now)
+            return future, True
+
+    def add(self, key):
+        """Record key and return True, or return False if it was already seen."""
+        future, new = self._claim(key)
+        if new:
+            future.set_result(None)
+        return new
+
+    def call(self, key, function, *args, **kwargs):
+        """Return function(*args, **kwargs), computed only once for this key."""
+        future, new = self._claim(key)
+        if not new:
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            with self.lock:
+                if self._entries.get(key, (None, None))[1] is future:
+                    del self._entries[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
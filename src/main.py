@@ -1,34 +1,167 @@
+from startup import LazyInit, startup
 import logging
 import uuid
 import asyncio
+import functools
+import tempfile
 from telegram import Update, ForceReply, InlineKeyboardButton, InlineKeyboardMarkup, MenuButtonWebApp, WebAppInfo, ReplyKeyboardMarkup, ReplyKeyboardRemove, constants
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, JobQueue
-from storage import ReservationStorage, BikeStorage, UserStorage
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ConversationHandler, JobQueue, TypeHandler
+from storage import CURRENT_STATUSES
+from async_storage import AsyncStorage
+from metrics import metrics
+from bot import InstrumentedBot
+from outbound import OutboundScheduler
+from reminders import ReservationTimers
+from idempotency import IdempotencyCache
+from updates import PerUserUpdateProcessor
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
+startup.mark("imports")
 
 # Conversation stages and button labels
 CHOOSING_FIELD, CHOOSE_PICKUP_TIME, CHOOSE_DURATION, CHOOSE_BIKE, CHOOSE_ASSOCIATION, SET_EMAIL = range(6)
 DURATION_OPTIONS = ["30 minutes", "1 hour", "3 hours", "5 hours", "1 day"]
+# Update types the handlers consume (web app data arrives inside messages)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
 # Variables
 bot_token = os.getenv("BOT_TOKEN")
+bot_mode = os.getenv("BOT_MODE", "polling")
+webhook_listen = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+webhook_port = int(os.getenv("WEBHOOK_PORT", "8443"))
+webhook_path = os.getenv("WEBHOOK_PATH", "telegram")
+webhook_url = os.getenv("WEBHOOK_URL")
+webhook_secret = os.getenv("WEBHOOK_SECRET")
+admin_ids = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
+metrics_port = int(os.getenv("METRICS_PORT", "0"))
+metrics_file = os.getenv("METRICS_FILE")
+metrics_interval = float(os.getenv("METRICS_INTERVAL", "60"))
+storage_dir = os.getenv("STORAGE_DIR", os.path.join(os.path.dirname(__file__), '../storage'))
+storage_backend = os.getenv("STORAGE_BACKEND", "csv")
+sqlite_path = os.getenv("SQLITE_PATH")
+user_compact_threshold = int(os.getenv("USER_COMPACT_THRESHOLD", "1000"))
+user_compact_interval = float(os.getenv("USER_COMPACT_INTERVAL", "0")) or None
+reservation_compact_threshold = int(os.getenv("RESERVATION_COMPACT_THRESHOLD", "1000"))
+storage_threads = int(os.getenv("STORAGE_THREADS", "16"))
+concurrent_updates = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# Writes are only batched when concurrent updates can have several of them in flight
+write_flush_interval = float(os.getenv("WRITE_FLUSH_INTERVAL", "0")) if concurrent_updates > 1 else None
+outbound_global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+outbound_chat_rate = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+outbound_chat_burst = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# Set by src/dispatcher.py when the bot runs as one of several worker processes
+worker_index = int(os.getenv("WORKER_INDEX", "0"))
+worker_count = int(os.getenv("WORKER_COUNT", "1"))
+availability_path = os.getenv("AVAILABILITY_DB")
+reminder_minutes = int(os.getenv("REMINDER_MINUTES", "60"))
+archive_after_days = int(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+compress_archive = os.getenv("ARCHIVE_COMPRESS", "1") != "0"
+res_page_size = int(os.getenv("RES_PAGE_SIZE", "8"))
+lazy_startup = os.getenv("LAZY_STARTUP", "1") != "0"
+startup_profile_file = os.getenv("STARTUP_PROFILE")
 
 # Set up logging
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the storage for reservations
-reservation_storage = ReservationStorage()
-bike_storage = BikeStorage()
-user_storage = UserStorage()
+# Initialize the storage for reservations. Nothing is read here: main() builds the
+# storage in the background while the bot already answers, and a handler only waits
+# for the storage it uses, e.g. /start and /help for none of them. The storage
+# modules are imported by the factories, on the build threads.
+def open_database():
+    from sqlite_storage import SQLiteDatabase
+    return SQLiteDatabase(sqlite_path or os.path.join(storage_dir, 'bot.db'))
 
-def get_main_menu_text(user_data):
-    text = f"<b>New Reservation:</b> \n" + get_reservation_text(user_data)
+def open_reservations():
+    if storage_backend == "sqlite":
+        from sqlite_storage import SQLiteReservationStorage
+        return SQLiteReservationStorage(database_lazy.get())
+    from storage import IndexedReservationStorage
+    owns_user = None
+    if worker_count > 1:
+        from dispatcher import shard_for
+        owns_user = lambda user_id: shard_for(user_id, worker_count) == worker_index
+    return IndexedReservationStorage(os.path.join(storage_dir, 'reservations.csv'), flush_interval=write_flush_interval, owns_user=owns_user, compress_archive=compress_archive, compact_threshold=reservation_compact_threshold)
+
+def open_bikes():
+    if storage_backend == "sqlite":
+        from sqlite_storage import SQLiteBikeStorage
+        return SQLiteBikeStorage(database_lazy.get())
+    from storage import BikeStorage
+    return BikeStorage(os.path.join(storage_dir, 'bikes.csv'))
+
+def open_users():
+    if storage_backend == "sqlite":
+        from sqlite_storage import SQLiteUserStorage
+        return SQLiteUserStorage(database_lazy.get())
+    from storage import UserStorage
+    return UserStorage(os.path.join(storage_dir, 'users.csv'), compact_threshold=user_compact_threshold, compact_interval=user_compact_interval, flush_interval=write_flush_interval)
+
+def open_availability():
+    if worker_count > 1:
+        # Other workers book bikes too, so availability is checked in a shared file
+        from availability import SharedBikeAvailability
+        return SharedBikeAvailability(reservations_lazy.get(), availability_path or os.path.join(storage_dir, 'availability.db'))
+    from availability import BikeAvailability
+    return BikeAvailability(reservations_lazy.get())
+
+if storage_backend not in ("csv", "sqlite"):
+    raise ValueError(f"Unknown STORAGE_BACKEND: {storage_backend}")
+database_lazy = LazyInit(open_database, "database")
+reservations_lazy = LazyInit(open_reservations, "reservations")
+bikes_lazy = LazyInit(open_bikes, "bikes")
+users_lazy = LazyInit(open_users, "users")
+availability_lazy = LazyInit(open_availability, "availability")
+lazy_storages = [reservations_lazy, bikes_lazy, users_lazy, availability_lazy]
+
+# Storage calls are awaited from the handlers and run on a bounded thread pool, off the event loop
+storage_executor = ThreadPoolExecutor(max_workers=storage_threads, thread_name_prefix="storage")
+reservation_storage = AsyncStorage(reservations_lazy, storage_executor, "reservations")
+bike_storage = AsyncStorage(bikes_lazy, storage_executor, "bikes")
+user_storage = AsyncStorage(users_lazy, storage_executor, "users")
+bike_availability = AsyncStorage(availability_lazy, storage_executor, "availability")
+
+# Updates already handled, in case Telegram or a webhook client delivers one twice
+processed_updates = IdempotencyCache(max_size=10000, ttl=3600)
+
+# Reminders and status transitions of the reservations this process serves
+reservation_timers = ReservationTimers(reservation_storage, timedelta(minutes=reminder_minutes), archive_after=timedelta(days=archive_after_days))
+
+async def get_main_menu_text(user_data):
+    text = f"<b>New Reservation:</b> \n" + await get_reservation_text(user_data)
     return text
 
-def get_reservation_text(user_data):
-    bike_name = bike_storage.get_bike_by_id(user_data['bike'])['name'] if 'bike' in user_data else 'Not set'
+def get_end_datetime(user_data):
+    """Compute the end of the reservation from its pickup time and duration."""
+    amount, unit = user_data['duration'].split()
+    if "minute" in unit:
+        return user_data['pickup_time'] + timedelta(minutes=int(amount))
+    elif "day" in unit:
+        return user_data['pickup_time'] + timedelta(days=int(amount))
+    return user_data['pickup_time'] + timedelta(hours=int(amount))
+
+@functools.lru_cache(maxsize=32)
+def get_bike_keyboard(bikes):
+    """Build the bike picker for a tuple of (bike_id, name, size), memoized across taps."""
+    keyboard = [[InlineKeyboardButton(f"{bike_id} - {name} ({size})", callback_data=f"bike_{bike_id}")] for bike_id, name, size in bikes]
+    return InlineKeyboardMarkup(keyboard)
+
+async def delete_later(message, delay:float):
+    """Delete a message after a delay, ignoring a message that is already gone."""
+    await asyncio.sleep(delay)
+    try:
+        await message.delete()
+    except TelegramError:
+        pass
+
+def flash_warning(context: ContextTypes.DEFAULT_TYPE, message):
+    """Remove a warning message in the background, so the handler returns right away."""
+    context.application.create_task(delete_later(message, 2))
+
+async def get_reservation_text(user_data):
+    bike_name = (await bike_storage.get_bike_by_id(user_data['bike']))['name'] if 'bike' in user_data else 'Not set'
     text = (
         f"Pickup Time: {user_data.get('pickup_time').strftime('%d-%m-%Y %H:%M') if 'pickup_time' in user_data else 'Not set'}\n"
         f"Duration: {user_data.get('duration', 'Not set')}\n"
@@ -38,6 +171,20 @@ def get_reservation_text(user_data):
     )
     return text
 
+async def record_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Note when the first update arrives, for the startup profile."""
+    if startup.mark("first_update"):
+        logger.info("First update received %.3fs after start", startup.marks["first_update"])
+        report_startup()
+
+async def skip_duplicate_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Stop a redelivered update before any handler sees it."""
+    key = f"callback_{update.callback_query.id}" if update.callback_query else f"update_{update.update_id}"
+    if not processed_updates.add(key):
+        logger.info("Skipping duplicate update %s", update.update_id)
+        raise ApplicationHandlerStop
+
+@metrics.instrument_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message when the command /start is issued."""
     user = update.effective_user
@@ -45,38 +192,95 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         rf"Hi {user.mention_html()}, blablabla je prete des cargos.",
     )
 
+@metrics.instrument_handler
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
     await update.message.reply_text(
         "Use /res to manage or create your reservations.",
     )
 
-async def res_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """List all reservations for the user and a button to create a new reservation."""
-    user_id = update.effective_user.id
-    reservations = reservation_storage.list_reservations_for_user(user_id)
+async def get_reservations_page(user_id:int, after=None, before=None):
+    """Return the text and keyboard of one page of the user's current reservations."""
+    reservations, has_previous, has_next = await reservation_storage.list_reservations_for_user_page(user_id, res_page_size, after, before, CURRENT_STATUSES)
 
     # Create buttons for each reservation
     keyboard = [
-        [InlineKeyboardButton(f"Reservation {n+1} - {res['start_datetime'].strftime('%d/%m/%Y')} ({res['status']})", callback_data=f"view_{res['reservation_id']}")] for n, res in enumerate(reservations)
+        [InlineKeyboardButton(f"{res['start_datetime'].strftime('%d/%m/%Y %H:%M')} ({res['status']})", callback_data=f"view_{res['reservation_id']}")] for res in reservations
     ]
+    # Pages are addressed by the reservation at their edge (keyset pagination)
+    navigation = []
+    if has_previous and reservations:
+        navigation.append(InlineKeyboardButton("« Previous", callback_data=f"res_prev_{reservations[0]['reservation_id']}"))
+    if has_next and reservations:
+        navigation.append(InlineKeyboardButton("Next »", callback_data=f"res_next_{reservations[-1]['reservation_id']}"))
+    if navigation:
+        keyboard.append(navigation)
     keyboard.append([InlineKeyboardButton("+ New Reservation...", callback_data="new_reservation")])
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    if reservations:
-        await update.message.reply_text("Here are your reservations:", reply_markup=reply_markup)
+
+    text = "Here are your reservations:" if reservations else "You currently have no reservations."
+    return text, InlineKeyboardMarkup(keyboard)
+
+@metrics.instrument_handler
+async def res_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the user's current reservations, one page at a time, and a button to create a new reservation."""
+    text, reply_markup = await get_reservations_page(update.effective_user.id)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+@metrics.instrument_handler
+async def res_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show the next or previous page of the reservation list in place."""
+    query = update.callback_query
+    await query.answer()
+    _, direction, reservation_id = query.data.split("_")
+    edge = await reservation_storage.get_reservation_by_id(int(reservation_id))
+    if edge is None:
+        # The reservation was archived meanwhile: start over
+        text, reply_markup = await get_reservations_page(update.effective_user.id)
+    else:
+        cursor = (edge['start_datetime'], edge['reservation_id'])
+        if direction == "next":
+            text, reply_markup = await get_reservations_page(update.effective_user.id, after=cursor)
+        else:
+            text, reply_markup = await get_reservations_page(update.effective_user.id, before=cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+@metrics.instrument_handler
+async def report_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send reservation statistics to an admin, or the gzipped full history with /report csv."""
+    if update.effective_user.id not in admin_ids:
+        await update.message.reply_text("This command is reserved to administrators.")
+        return
+
+    if context.args and context.args[0] == "startup":
+        await update.message.reply_text(startup.report())
+        return
+
+    # Reports stream the whole history, so they run on the storage thread pool
+    from reports import summarize, export_csv
+    loop = asyncio.get_running_loop()
+    await asyncio.wrap_future(reservations_lazy.future)
+    if context.args and context.args[0] == "csv":
+        with tempfile.TemporaryFile() as export:
+            await loop.run_in_executor(storage_executor, export_csv, reservations_lazy.get(), export, True)
+            if export.tell() > constants.FileSizeLimit.FILESIZE_UPLOAD:
+                await update.message.reply_text("The export is larger than Telegram's upload limit, run this on the server instead: python src/reports.py csv")
+                return
+            export.seek(0)
+            await update.message.reply_document(export, filename="reservations.csv.gz")
     else:
-        await update.message.reply_text("You currently have no reservations.", reply_markup=reply_markup)
+        text = await loop.run_in_executor(storage_executor, summarize, reservations_lazy.get())
+        await update.message.reply_text(text[:constants.MessageLimit.MAX_TEXT_LENGTH])
 
+@metrics.instrument_handler
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button presses."""
     query = update.callback_query
     await query.answer()
     
     if query.data.startswith("view_"):
-        print("Viewing reservation")
+        logger.debug("Viewing reservation %s", query.data)
         reservation_id = int(query.data.split("_")[1])
-        reservation = reservation_storage.get_reservation_by_id(reservation_id)
+        reservation = await reservation_storage.get_reservation_by_id(reservation_id)
         reservation_details = "\n".join([f"{key}: {value}" for key, value in reservation.items()])
         await query.message.reply_text(f"Details for reservation {reservation_id}:\n{reservation_details}")
     
@@ -86,17 +290,18 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await cancel(update, context)
         context.user_data.clear()  # Clear any previous reservation data
         
-        # Set user association and email if already saved
-        user = user_storage.get_user_by_id(update.effective_user.id)
+        # Set user association and email if already saved
+        user = await user_storage.get_user_by_id(update.effective_user.id)
         if user:
             context.user_data['association'] = user['association']
             context.user_data['email'] = user['email']
         return await show_main_menu(update, context)
     
+@metrics.instrument_handler
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Display the reservation input options with current values."""
     user_data = context.user_data
-    text = get_main_menu_text(user_data)
+    text = await get_main_menu_text(user_data)
 
     keyboard = [
         [InlineKeyboardButton(f"Choose Pickup Time{' ✔️' if 'pickup_time' in user_data else ''}", callback_data="choose_pickup_time")],
@@ -124,6 +329,7 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     return CHOOSING_FIELD
 
+@metrics.instrument_handler
 async def handle_field_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Route to the correct handler based on the selected option."""
     query = update.callback_query
@@ -149,10 +355,21 @@ async def handle_field_callback(update: Update, context: ContextTypes.DEFAULT_TY
         return CHOOSE_DURATION
     
     elif query.data == "choose_bike":
-        # Provide bike options
-        bikes = bike_storage.list_bikes()
-        keyboard = [[InlineKeyboardButton(f"{bike['bike_id']} - {bike['name']} ({bike['size']})", callback_data=f"bike_{bike['bike_id']}")] for bike in bikes]
-        await query.edit_message_text("Choose a bike:", reply_markup=InlineKeyboardMarkup(keyboard))
+        # Provide bike options, limited to the free ones once the time window is known
+        bikes = await bike_storage.list_bikes()
+        if 'pickup_time' in context.user_data and 'duration' in context.user_data:
+            free_bike_ids = set(await bike_availability.available_bikes(
+                [bike['bike_id'] for bike in bikes],
+                context.user_data['pickup_time'],
+                get_end_datetime(context.user_data),
+            ))
+            bikes = [bike for bike in bikes if bike['bike_id'] in free_bike_ids]
+        if not bikes:
+            keyboard = [[InlineKeyboardButton("« Back", callback_data="back_to_menu")]]
+            await query.edit_message_text("No bike is available for this time slot.", reply_markup=InlineKeyboardMarkup(keyboard))
+            return CHOOSE_BIKE
+        reply_markup = get_bike_keyboard(tuple((bike['bike_id'], bike['name'], bike['size']) for bike in bikes))
+        await query.edit_message_text("Choose a bike:", reply_markup=reply_markup)
         return CHOOSE_BIKE
 
     elif query.data == "choose_association":
@@ -173,6 +390,7 @@ async def handle_field_callback(update: Update, context: ContextTypes.DEFAULT_TY
         # Validate and save the reservation if all fields are filled
         return await validate_reservation(update, context)
 
+@metrics.instrument_handler
 async def handle_web_app_pickup_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle pickup time received from web app."""
     web_app_data = update.message.web_app_data.data.split("_")
@@ -180,12 +398,15 @@ async def handle_web_app_pickup_data(update: Update, context: ContextTypes.DEFAU
     start_datetime = datetime.fromtimestamp(timestamp / 1000)
     context.user_data['pickup_time'] = start_datetime
     
-    # Delete the pickup keyboard message
-    await context.bot.delete_message(update.effective_chat.id, context.user_data['pickup_time_keyboard_message_id'])
-    context.user_data.pop('pickup_time_keyboard_message_id')
-    
-    return await show_main_menu(update, context)
+    # Delete the pickup keyboard message while the menu is redrawn
+    keyboard_message_id = context.user_data.pop('pickup_time_keyboard_message_id')
+    _, state = await asyncio.gather(
+        context.bot.delete_message(update.effective_chat.id, keyboard_message_id),
+        show_main_menu(update, context),
+    )
+    return state
 
+@metrics.instrument_handler
 async def set_duration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Set duration from button selection."""
     query = update.callback_query
@@ -197,6 +418,7 @@ async def set_duration(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     
     return await show_main_menu(update, context)
 
+@metrics.instrument_handler
 async def set_bike(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Set bike name based on user input."""
     query = update.callback_query
@@ -205,24 +427,33 @@ async def set_bike(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     
     return await show_main_menu(update, context)
 
+@metrics.instrument_handler
+async def back_to_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Return to the main menu without changing any field."""
+    await update.callback_query.answer()
+    return await show_main_menu(update, context)
+
+@metrics.instrument_handler
 async def set_association(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Set association name based on user input."""
     context.user_data['association'] = update.message.text
     
-    # Delete the association message and user's message
-    await update.message.delete()
+    # Delete the association message and user's message while the menu is redrawn
     # await context.bot.delete_message(update.effective_chat.id, context.user_data['association_message_id'])
-    return await show_main_menu(update, context)
+    _, state = await asyncio.gather(update.message.delete(), show_main_menu(update, context))
+    return state
 
+@metrics.instrument_handler
 async def set_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Set email based on user input."""
     context.user_data['email'] = update.message.text
     
-    # Delete the email message and user's message
-    await update.message.delete()
+    # Delete the email message and user's message while the menu is redrawn
     # await context.bot.delete_message(update.effective_chat.id, context.user_data['email_message_id'])
-    return await show_main_menu(update, context)
+    _, state = await asyncio.gather(update.message.delete(), show_main_menu(update, context))
+    return state
 
+@metrics.instrument_handler
 async def validate_reservation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Validate reservation fields and save if all fields are filled."""
     required_fields = ["pickup_time", "duration", "bike", "association", "email"]
@@ -230,19 +461,16 @@ async def validate_reservation(update: Update, context: ContextTypes.DEFAULT_TYP
 
     if missing_fields:
         warning_msg = await update.callback_query.message.reply_text(f"Missing fields: {', '.join(missing_fields)}")
-        await asyncio.sleep(2)
-        await warning_msg.delete()
+        flash_warning(context, warning_msg)
         return CHOOSING_FIELD
     
-    # Calculate end datetime
-    duration_parts = context.user_data['duration'].split()
-    if "minute" in duration_parts[1]:
-        context.user_data['end_datetime'] = context.user_data['pickup_time'] + timedelta(minutes=int(duration_parts[0]))
-    else:
-        context.user_data['end_datetime'] = context.user_data['pickup_time'] + timedelta(hours=int(duration_parts[0]))
+    # Calculate end datetime
+    context.user_data['end_datetime'] = get_end_datetime(context.user_data)
+    # A menu is validated at most once: repeated taps or replays reuse the first booking
+    idempotency_key = f"{update.effective_user.id}:{context.user_data['main_menu_message_id']}"
 
-    # Save reservation
-    reservation_storage.add_reservation(
+    # Save reservation, unless the bike was booked in the meantime
+    reservation_id = await bike_availability.reserve(
         update.effective_user.id,
         update.effective_user.username,
         update.effective_user.first_name,
@@ -253,60 +481,69 @@ async def validate_reservation(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data['pickup_time'],
         context.user_data['end_datetime'],
         'accepted',
+        idempotency_key=idempotency_key,
     )
-    
-    # Save user in db if not already saved
-    if not user_storage.get_user_by_id(update.effective_user.id):
-        user_storage.add_user(
-            update.effective_user.id,
-            update.effective_user.username,
-            update.effective_user.first_name,
-            update.effective_user.last_name,
-        context.user_data['association'],
-            context.user_data['email'],
-        )
-    # Update association and email if user already exists
-    else:
-        user_storage.update_user(
-            update.effective_user.id,
-            update.effective_user.username,
-            update.effective_user.first_name,
-            update.effective_user.last_name,
-            context.user_data['association'],
-            context.user_data['email'],
+    if reservation_id is None:
+        context.user_data.pop('bike')
+        warning_msg, _ = await asyncio.gather(
+            update.callback_query.message.reply_text("This bike is no longer available for this time slot, please choose another one."),
+            show_main_menu(update, context),
         )
+        flash_warning(context, warning_msg)
+        return CHOOSING_FIELD
+    reservation_timers.schedule(reservation_id, context.user_data['pickup_time'], context.user_data['end_datetime'], 'accepted')
     
-    # Delete main menu message
-    await context.bot.delete_message(update.effective_chat.id, context.user_data['main_menu_message_id'])
+    # Save the user's latest details; both backends add users they don't know yet
+    await user_storage.update_user(
+        update.effective_user.id,
+        update.effective_user.username,
+        update.effective_user.first_name,
+        update.effective_user.last_name,
+        context.user_data['association'],
+        context.user_data['email'],
+        idempotency_key=idempotency_key,
+    )
     
-    # Validate and display reservation
-    text = "Reservation created successfully!\n\n" + get_reservation_text(context.user_data)
-    await update.callback_query.message.reply_text(text)
+    # Delete main menu message and display the reservation
+    text = "Reservation created successfully!\n\n" + await get_reservation_text(context.user_data)
+    await asyncio.gather(
+        context.bot.delete_message(update.effective_chat.id, context.user_data['main_menu_message_id']),
+        update.callback_query.message.reply_text(text),
+    )
     
     context.user_data.clear()  # Clear data after saving
     return ConversationHandler.END
 
+@metrics.instrument_handler
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel the conversation."""
-    await context.bot.send_message(update.effective_chat.id, "Reservation creation canceled.")
-    await context.bot.delete_message(update.effective_chat.id, context.user_data['main_menu_message_id'])
-        
+    chat_id = update.effective_chat.id
+    requests = [
+        context.bot.send_message(chat_id, "Reservation creation canceled."),
+        context.bot.delete_message(chat_id, context.user_data['main_menu_message_id']),
+    ]
     # Delete any messages that were sent during the conversation
     if context.user_data.get('pickup_time_keyboard_message_id'):
-        await context.bot.delete_message(update.effective_chat.id, context.user_data['pickup_time_keyboard_message_id'])
+        requests.append(context.bot.delete_message(chat_id, context.user_data['pickup_time_keyboard_message_id']))
+    await asyncio.gather(*requests)
 
     context.user_data.clear()
     return ConversationHandler.END
 
-def main() -> None:
-    """Start the bot."""
-     # Create the Application and pass it your bot's token.
-    application = Application.builder().token(bot_token).build()
+def build_application(builder) -> Application:
+    """Build the Application from a configured ApplicationBuilder and register the handlers."""
+    # Users are served concurrently, each user's updates in order
+    application = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates)).build()
+
+    # Run before every other handler group
+    application.add_handler(TypeHandler(Update, record_first_update), group=-2)
+    application.add_handler(TypeHandler(Update, skip_duplicate_updates), group=-1)
 
     # on different commands - answer in Telegram
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("res", res_command))
+    application.add_handler(CommandHandler("report", report_command))
     
     # Set up the conversation handler
     conv_handler = ConversationHandler(
@@ -315,7 +552,7 @@ def main() -> None:
             CHOOSING_FIELD: [CallbackQueryHandler(handle_field_callback)],
             CHOOSE_PICKUP_TIME: [MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_pickup_data)],
             CHOOSE_DURATION: [CallbackQueryHandler(set_duration, pattern="^duration_")],
-            CHOOSE_BIKE: [CallbackQueryHandler(set_bike, pattern="^bike_")],
+            CHOOSE_BIKE: [CallbackQueryHandler(set_bike, pattern="^bike_"), CallbackQueryHandler(back_to_menu, pattern="^back_to_menu$")],
             CHOOSE_ASSOCIATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_association)],
             SET_EMAIL: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_email)],
         },
@@ -324,10 +561,61 @@ def main() -> None:
     application.add_handler(conv_handler)
     
     # Handle callback queries for reservation buttons
+    application.add_handler(CallbackQueryHandler(res_page, pattern="^res_(next|prev)_"))
     application.add_handler(CallbackQueryHandler(handle_callback))
+
+    reservation_timers.start(application.job_queue)
+    return application
+
+def report_startup() -> None:
+    """Log the startup profile, and save it, once the storage is built and the first update arrived."""
+    if "storage_ready" in startup.marks and "first_update" in startup.marks and not startup.reported:
+        startup.reported = True
+        logger.info(startup.report())
+        if startup_profile_file:
+            startup.save(startup_profile_file)
+
+async def finish_startup(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Queue the reservation timers and wait for the rest of the storage, once the bot is running."""
+    startup.mark("started")
+    reservations = await reservation_storage.list_reservations()
+    if storage_backend == "sqlite" and worker_count > 1:
+        from dispatcher import shard_for
+        reservations = [res for res in reservations if shard_for(res['user_id'], worker_count) == worker_index]
+    reservation_timers.load(reservations)
+    await asyncio.gather(*(asyncio.wrap_future(storage.future) for storage in lazy_storages))
+    startup.mark("storage_ready")
+    logger.info("Storage ready %.3fs after start", startup.marks["storage_ready"])
+    report_startup()
+
+def main() -> None:
+    """Start the bot."""
+     # Create the Application and pass it your bot's token.
+    # The global Bot API limit is shared by all workers; chats are each served by one worker
+    scheduler = OutboundScheduler(outbound_global_rate / worker_count, outbound_chat_rate, outbound_chat_burst)
+    application = build_application(Application.builder().bot(InstrumentedBot(bot_token, rate_limiter=scheduler)))
+    for storage in lazy_storages:
+        storage.start()
+    if not lazy_startup:
+        # Answer the first update only once every index is built
+        for storage in lazy_storages:
+            storage.get()
+    application.job_queue.run_once(finish_startup, 0, name="finish_startup")
+
+    if metrics_port:
+        metrics.serve(metrics_port + worker_index)
+    if metrics_file:
+        metrics.dump_periodically(f"{metrics_file}.{worker_index}" if worker_count > 1 else metrics_file, metrics_interval)
     
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if bot_mode == "webhook":
+        from webhook import run_webhook
+        try:
+            asyncio.run(run_webhook(application, webhook_listen, webhook_port, webhook_path, webhook_url, webhook_secret, ALLOWED_UPDATES))
+        except KeyboardInterrupt:
+            pass
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
     
 if __name__ == '__main__':
     main()
@@ -0,0 +1,132 @@
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from sub-millisecond storage hits to slow Bot API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DESCRIPTIONS = {
+    'bot_handler_seconds': "Time spent in Telegram update handlers.",
+    'bot_storage_seconds': "Time spent in storage calls, excluding the wait for a storage thread.",
+    'bot_api_seconds': "Time spent in outbound Bot API requests.",
+    'bot_api_queue_seconds': "Time outbound Bot API requests waited for the rate limiter before being sent.",
+    'bot_startup_seconds': "Process start timeline: seconds after start of each milestone, and duration of each startup phase.",
+}
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus layout."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Latency histograms keyed by metric name and label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, name:str, seconds:float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, name:str, **labels):
+        """Record the duration of the with-block, whether or not it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def instrument_handler(self, handler):
+        """Decorate an async Telegram handler to record its latency."""
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            with self.timed('bot_handler_seconds', handler=handler.__name__):
+                return await handler(*args, **kwargs)
+        return wrapper
+
+    def render(self):
+        """Return all histograms in the Prometheus text exposition format."""
+        with self.lock:
+            snapshot = sorted((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items())
+        lines = []
+        current_name = None
+        for (name, labels), counts, total, count, buckets in snapshot:
+            if name != current_name:
+                current_name = name
+                if name in DESCRIPTIONS:
+                    lines.append(f"# HELP {name} {DESCRIPTIONS[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            label_text = ','.join(f'{label}="{value}"' for label, value in labels)
+            separator = ',' if label_text else ''
+            cumulative = 0
+            for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{{{label_text}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port:int, host:str='127.0.0.1'):
+        """Expose /metrics over HTTP from a daemon thread."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("Metrics available on http://%s:%s/metrics", host, port)
+        return server
+
+    def dump_periodically(self, filename:str, interval:float):
+        """Rewrite filename with the current metrics every interval seconds, from a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with open(filename + '.tmp', 'w') as f:
+                        f.write(self.render())
+                    os.replace(filename + '.tmp', filename)
+                except OSError:
+                    logger.exception("Failed to write metrics to %s", filename)
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bot API limits: about 30 requests per second overall and 1 per second in a chat,
+# with short bursts tolerated in private chats
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at ``rate`` tokens per second, up to ``capacity``.
+
+    Waiting callers are served first come, first served.
+    """
+
+    def __init__(self, rate:float, capacity:float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def take(self):
+        """Wait until a token is available and take it; the caller holds ``lock``."""
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    async def acquire(self):
+        """Wait for a token behind the callers that asked first, and take it."""
+        async with self.lock:
+            await self.take()
+
+    def pause(self, seconds:float):
+        """Hand out no token for the next ``seconds``, e.g. after a 429."""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter for outbound Bot API requests.
+
+    Every request takes a token from a global bucket, and requests addressed to a
+    chat also from that chat's bucket, so bursts are smoothed out instead of being
+    answered with 429s. A chat's requests are sent one at a time in the order they
+    were made, while other chats go ahead. A 429 pauses the bucket it applies to and
+    the request is retried before the chat's next request.
+
+    The time a request waits here is recorded as ``bot_api_queue_seconds`` and the
+    request itself as ``bot_api_seconds``, so the latter only measures Telegram.
+    """
+
+    def __init__(self, global_rate:float=GLOBAL_RATE, chat_rate:float=CHAT_RATE, chat_burst:float=CHAT_BURST, max_retries:int=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {key: value for key, value in self._chat_buckets.items() if value.lock.locked() or not value.is_full()}
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_bucket):
+        if chat_bucket is not None:
+            await chat_bucket.take()
+        await self.global_bucket.acquire()
+
+    async def _send(self, callback, args, kwargs, chat_id, chat_bucket, endpoint:str, queued:float):
+        """Call the Bot API, waiting and retrying as long as Telegram answers with a 429."""
+        await self._acquire(chat_bucket)
+        metrics.observe('bot_api_queue_seconds', time.perf_counter() - queued, method=endpoint)
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.timed('bot_api_seconds', method=endpoint):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("Rate limited by Telegram for %ss (chat %s)", e.retry_after, chat_id)
+                (chat_bucket or self.global_bucket).pause(e.retry_after)
+                await self._acquire(chat_bucket)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        queued = time.perf_counter()
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await self._send(callback, args, kwargs, None, None, endpoint, queued)
+        chat_bucket = self._chat_bucket(chat_id)
+        # Held until the request is answered, so a retried request is not overtaken
+        async with chat_bucket.lock:
+            return await self._send(callback, args, kwargs, chat_id, chat_bucket, endpoint, queued)
@@ -0,0 +1,130 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime, timedelta
+
+from telegram.ext import ContextTypes, JobQueue
+
+logger = logging.getLogger(__name__)
+
+REMIND, START, END = 'remind', 'start', 'end'
+
+
+class ReservationTimers:
+    """Pickup reminders and status transitions driven by one heap of deadlines.
+
+    Each current reservation puts at most three events in a heap ordered by time: a
+    reminder before pickup, its start and its end. A single JobQueue job is armed for
+    the earliest deadline; when it fires, every event due within ``batch_window`` is
+    handled, the resulting status changes are written with one ``update_statuses``
+    call, which also archives old finished reservations, and the job is re-armed.
+
+    Transitions: pending reservations expire at their start, accepted ones become
+    active at their start and completed at their end.
+    """
+
+    def __init__(self, reservation_storage, remind_before:timedelta=timedelta(hours=1), batch_window:timedelta=timedelta(minutes=1), archive_after:timedelta=timedelta(days=7)):
+        self.reservation_storage = reservation_storage
+        self.remind_before = remind_before
+        self.batch_window = batch_window
+        self.archive_after = archive_after
+        self.job_queue = None
+        self._heap = []
+        self._counter = itertools.count()  # ties are broken by insertion order
+        self._job = None
+        self._job_due = None
+
+    def _push(self, when:datetime, reservation_id:int, event:str):
+        heapq.heappush(self._heap, (when, next(self._counter), reservation_id, event))
+
+    def _add(self, reservation_id:int, start:datetime, end:datetime, status:str, now:datetime):
+        if status in ('pending', 'accepted'):
+            if start - self.remind_before > now:
+                self._push(start - self.remind_before, reservation_id, REMIND)
+            self._push(start, reservation_id, START)
+        if status in ('accepted', 'active'):
+            self._push(end, reservation_id, END)
+
+    def load(self, reservations):
+        """Queue the events of existing reservations, e.g. at startup."""
+        now = datetime.now()
+        for reservation in reservations:
+            self._add(reservation['reservation_id'], reservation['start_datetime'], reservation['end_datetime'], reservation['status'], now)
+        self._arm()
+
+    def schedule(self, reservation_id:int, start:datetime, end:datetime, status:str):
+        """Queue the events of a new reservation."""
+        self._add(reservation_id, start, end, status, datetime.now())
+        self._arm()
+
+    def start(self, job_queue:JobQueue):
+        self.job_queue = job_queue
+        self._arm()
+
+    def _arm(self):
+        """Make sure the job fires at the earliest deadline."""
+        if self.job_queue is None or not self._heap:
+            return
+        due = self._heap[0][0]
+        if self._job is not None:
+            if self._job_due <= due:
+                return
+            self._job.schedule_removal()
+        self._job_due = due
+        self._job = self.job_queue.run_once(self._run, max((due - datetime.now()).total_seconds(), 0), name="reservation_timers")
+
+    async def _run(self, context:ContextTypes.DEFAULT_TYPE):
+        self._job = None
+        try:
+            await self._run_due(context)
+        finally:
+            # Whatever failed, the next deadline must still fire
+            self._arm()
+
+    async def _run_due(self, context:ContextTypes.DEFAULT_TYPE):
+        now = datetime.now()
+        horizon = now + self.batch_window
+        due = []
+        while self._heap and self._heap[0][0] <= horizon:
+            due.append(heapq.heappop(self._heap))
+
+        statuses = {}
+        reminders = {}  # a reservation scheduled twice is only reminded once
+        try:
+            for when, _, reservation_id, event in due:
+                reservation = await self.reservation_storage.get_reservation_by_id(reservation_id)
+                if reservation is None:
+                    continue
+                # A reservation may both start and end within one batch
+                status = statuses.get(reservation_id, reservation['status'])
+                if event == REMIND and status in ('pending', 'accepted'):
+                    reminders[reservation_id] = reservation
+                elif event == START and status == 'pending':
+                    statuses[reservation_id] = 'expired'
+                elif event == START and status == 'accepted':
+                    statuses[reservation_id] = 'active'
+                elif event == END and status == 'active':
+                    statuses[reservation_id] = 'completed'
+        except Exception:
+            # Nothing was written or sent yet, so the whole batch is retried
+            logger.exception("Failed to read %s due reservations, retrying later", len(due))
+            for _, _, reservation_id, event in due:
+                self._push(horizon, reservation_id, event)
+            return
+
+        if statuses:
+            try:
+                await self.reservation_storage.update_statuses(statuses, now - self.archive_after)
+            except Exception:
+                logger.exception("Failed to update %s reservation statuses, retrying later", len(statuses))
+                for _, _, reservation_id, event in due:
+                    if event != REMIND:
+                        self._push(horizon, reservation_id, event)
+        results = await asyncio.gather(*(
+            context.bot.send_message(reservation['user_id'], f"Reminder: your reservation of bike {reservation['bike_id']} starts at {reservation['start_datetime']:%H:%M} on {reservation['start_datetime']:%d/%m/%Y}.")
+            for reservation in reminders.values()
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Failed to send a reminder: %s", result)
@@ -0,0 +1,132 @@
+import argparse
+import csv
+import gzip
+import io
+import os
+import sys
+from collections import Counter, defaultdict
+
+from storage import ReservationStorage, RESERVATION_FIELDS
+
+dirname = os.path.dirname(__file__)
+
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+class ReservationReport:
+    """Single-pass aggregates over a stream of reservations.
+
+    Memory grows with the number of bikes and associations, never with the number of
+    reservations, so any iterable of reservations can be fed through ``add``.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.first_start = None
+        self.last_start = None
+        self.by_status = Counter()
+        self.bookings_per_bike = Counter()
+        self.hours_per_bike = defaultdict(float)
+        self.bookings_per_association = Counter()
+        self.bookings_per_hour = [0] * 24
+        self.bookings_per_weekday = [0] * 7
+
+    @classmethod
+    def from_reservations(cls, reservations):
+        report = cls()
+        for reservation in reservations:
+            report.add(reservation)
+        return report
+
+    def add(self, reservation):
+        start = reservation['start_datetime']
+        self.total += 1
+        if self.first_start is None or start < self.first_start:
+            self.first_start = start
+        if self.last_start is None or start > self.last_start:
+            self.last_start = start
+        self.by_status[reservation['status']] += 1
+        self.bookings_per_bike[reservation['bike_id']] += 1
+        self.hours_per_bike[reservation['bike_id']] += (reservation['end_datetime'] - start).total_seconds() / 3600
+        self.bookings_per_association[reservation['association_name']] += 1
+        self.bookings_per_hour[start.hour] += 1
+        self.bookings_per_weekday[start.weekday()] += 1
+
+    def utilization(self, bike_id):
+        """Share of the reported period during which the bike was booked."""
+        if self.first_start is None:
+            return 0.0
+        period_hours = max((self.last_start - self.first_start).total_seconds() / 3600, 1)
+        return self.hours_per_bike[bike_id] / period_hours
+
+    def summary_text(self, top:int=10):
+        """Render the aggregates as plain text."""
+        if not self.total:
+            return "No reservations."
+        lines = [
+            f"Reservations: {self.total} ({self.first_start:%d/%m/%Y} - {self.last_start:%d/%m/%Y})",
+            "Status: " + ", ".join(f"{status} {count}" for status, count in self.by_status.most_common()),
+            "",
+            "Per bike (bookings, hours, utilization):",
+        ]
+        for bike_id in sorted(self.bookings_per_bike):
+            lines.append(f"  {bike_id}: {self.bookings_per_bike[bike_id]}, {self.hours_per_bike[bike_id]:.1f}h, {self.utilization(bike_id):.1%}")
+        lines += ["", f"Top {top} associations:"]
+        for association, count in self.bookings_per_association.most_common(top):
+            lines.append(f"  {association or '-'}: {count}")
+        peak_hours = sorted(range(24), key=lambda hour: self.bookings_per_hour[hour], reverse=True)[:3]
+        lines += [
+            "",
+            "Peak pickup hours: " + ", ".join(f"{hour:02d}h ({self.bookings_per_hour[hour]})" for hour in peak_hours),
+            "Per weekday: " + ", ".join(f"{day} {count}" for day, count in zip(WEEKDAYS, self.bookings_per_weekday)),
+        ]
+        return "\n".join(lines)
+
+
+def write_csv(reservations, output):
+    """Stream reservations to a file object as CSV, one row at a time."""
+    writer = csv.writer(output)
+    writer.writerow(RESERVATION_FIELDS)
+    count = 0
+    for reservation in reservations:
+        writer.writerow([reservation[field] for field in RESERVATION_FIELDS])
+        count += 1
+    return count
+
+
+def summarize(reservation_storage, top:int=10):
+    """Aggregate the whole reservation history of a storage into summary text."""
+    return ReservationReport.from_reservations(reservation_storage.iter_reservations()).summary_text(top)
+
+
+def export_csv(reservation_storage, output, compress:bool=False):
+    """Stream the whole reservation history of a storage as CSV into a binary file object, gzipped if compress is set."""
+    target = gzip.GzipFile(fileobj=output, mode='wb', mtime=0) if compress else output
+    text_output = io.TextIOWrapper(target, encoding='utf-8', newline='')
+    try:
+        return write_csv(reservation_storage.iter_reservations(), text_output)
+    finally:
+        text_output.flush()
+        text_output.detach()
+        if compress:
+            target.close()  # writes the gzip trailer, leaving output open
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report on the reservation history.")
+    parser.add_argument('format', choices=['summary', 'csv'], help="aggregated summary or full CSV export")
+    parser.add_argument('--storage-dir', default=os.getenv("STORAGE_DIR", os.path.join(dirname,'../storage')), help="directory containing reservations.csv")
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default=os.getenv("STORAGE_BACKEND", "csv"))
+    parser.add_argument('--top', type=int, default=10, help="number of associations listed in the summary")
+    args = parser.parse_args()
+
+    if args.backend == 'sqlite':
+        from sqlite_storage import SQLiteDatabase, SQLiteReservationStorage
+        storage = SQLiteReservationStorage(SQLiteDatabase(os.getenv("SQLITE_PATH") or os.path.join(args.storage_dir, 'bot.db')))
+    else:
+        storage = ReservationStorage(os.path.join(args.storage_dir, 'reservations.csv'))
+
+    if args.format == 'csv':
+        write_csv(storage.iter_reservations(), sys.stdout)
+    else:
+        print(summarize(storage, args.top))
@@ -0,0 +1,272 @@
+import argparse
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+
+from idempotency import IdempotencyCache
+from storage import BaseReservationStorage, BaseBikeStorage, BaseUserStorage, ReservationStorage, BikeStorage, UserStorage, Reservation, parse_datetime, FINISHED_STATUSES
+
+dirname = os.path.dirname(__file__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    reservation_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    association_name TEXT,
+    email TEXT,
+    bike_id INTEGER NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_user_id ON reservations (user_id);
+CREATE INDEX IF NOT EXISTS reservations_user_start ON reservations (user_id, start_datetime, reservation_id);
+CREATE INDEX IF NOT EXISTS reservations_bike_id ON reservations (bike_id, start_datetime);
+CREATE INDEX IF NOT EXISTS reservations_start_datetime ON reservations (start_datetime);
+
+CREATE TABLE IF NOT EXISTS reservations_archive (
+    reservation_id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    association_name TEXT,
+    email TEXT,
+    bike_id INTEGER NOT NULL,
+    start_datetime TEXT NOT NULL,
+    end_datetime TEXT NOT NULL,
+    status TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bikes (
+    bike_id INTEGER PRIMARY KEY,
+    size TEXT,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    association TEXT,
+    email TEXT
+);
+"""
+
+# Statements are kept constant so sqlite3's per-connection statement cache reuses
+# the compiled (prepared) form on every call.
+INSERT_RESERVATION = "INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SELECT_RESERVATION_BY_ID = "SELECT * FROM reservations WHERE reservation_id = ?"
+SELECT_RESERVATIONS = "SELECT * FROM reservations"
+SELECT_RESERVATIONS_FOR_USER = "SELECT * FROM reservations WHERE user_id = ? ORDER BY start_datetime"
+SELECT_ARCHIVED_RESERVATION_BY_ID = "SELECT * FROM reservations_archive WHERE reservation_id = ?"
+SELECT_ARCHIVED_RESERVATIONS = "SELECT * FROM reservations_archive"
+UPDATE_RESERVATION_STATUS = "UPDATE reservations SET status = ? WHERE reservation_id = ?"
+_FINISHED = ", ".join(f"'{status}'" for status in sorted(FINISHED_STATUSES))
+ARCHIVE_RESERVATIONS = f"INSERT OR REPLACE INTO reservations_archive SELECT * FROM reservations WHERE status IN ({_FINISHED}) AND end_datetime < ?"
+DELETE_ARCHIVED_RESERVATIONS = f"DELETE FROM reservations WHERE status IN ({_FINISHED}) AND end_datetime < ?"
+INSERT_BIKE = "INSERT INTO bikes VALUES (?, ?, ?)"
+SELECT_BIKE_BY_ID = "SELECT * FROM bikes WHERE bike_id = ?"
+SELECT_BIKES = "SELECT * FROM bikes ORDER BY bike_id"
+UPSERT_USER = "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_USER_BY_ID = "SELECT * FROM users WHERE user_id = ?"
+SELECT_USERS = "SELECT * FROM users"
+
+
+def to_sql_id(reservation_id):
+    """Map an unsigned 64-bit reservation ID onto SQLite's signed INTEGER range."""
+    return reservation_id - (1 << 64) if reservation_id >= (1 << 63) else reservation_id
+
+
+def from_sql_id(reservation_id):
+    return reservation_id + (1 << 64) if reservation_id < 0 else reservation_id
+
+
+def _reservation_from_row(row):
+    return Reservation(from_sql_id(row[0]), row[1], row[2], row[3], row[4], row[5], row[6], row[7], parse_datetime(row[8]), parse_datetime(row[9]), row[10])
+
+
+class SQLiteDatabase:
+    """SQLite database shared by the SQLite storage classes.
+
+    Every thread gets its own connection so readers run concurrently; the database
+    is in WAL mode, so readers are not blocked by the single writer either.
+    """
+
+    def __init__(self, filename=os.path.join(dirname,'../storage/bot.db'), schema:str=SCHEMA):
+        self.filename = filename
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(schema)
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+
+class SQLiteReservationStorage(BaseReservationStorage):
+    def __init__(self, database:SQLiteDatabase):
+        self.database = database
+        self.idempotency = IdempotencyCache()
+
+    def add_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending', idempotency_key:str=None):
+        """Insert a new reservation and return its ID."""
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.add_reservation, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        reservation_id = int(uuid.uuid4().int >> 64)
+        with self.database.connection() as connection:
+            connection.execute(INSERT_RESERVATION, (to_sql_id(reservation_id), user_id, username, first_name, last_name, association_name, email, bike_id, str(start_datetime), str(end_datetime), status))
+        return reservation_id
+
+    def get_reservation_by_id(self, reservation_id):
+        """Retrieve a reservation by its ID."""
+        connection = self.database.connection()
+        row = connection.execute(SELECT_RESERVATION_BY_ID, (to_sql_id(reservation_id),)).fetchone()
+        if row is None:
+            row = connection.execute(SELECT_ARCHIVED_RESERVATION_BY_ID, (to_sql_id(reservation_id),)).fetchone()
+        return _reservation_from_row(row) if row is not None else None
+
+    def list_reservations(self):
+        """List all reservations."""
+        return [_reservation_from_row(row) for row in self.database.connection().execute(SELECT_RESERVATIONS)]
+
+    def iter_reservations(self):
+        """Stream all reservations from a cursor, archived ones first."""
+        for row in self.database.connection().execute(SELECT_ARCHIVED_RESERVATIONS):
+            yield _reservation_from_row(row)
+        for row in self.database.connection().execute(SELECT_RESERVATIONS):
+            yield _reservation_from_row(row)
+
+    def list_reservations_for_user(self, user_id):
+        """List all reservations for a specific user."""
+        return [_reservation_from_row(row) for row in self.database.connection().execute(SELECT_RESERVATIONS_FOR_USER, (user_id,))]
+
+    def list_reservations_for_user_page(self, user_id, limit:int, after=None, before=None, statuses=None):
+        """Return one page of a user's reservations with a keyset query on the user index."""
+        conditions = ["user_id = ?"]
+        parameters = [user_id]
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})")
+            parameters += sorted(statuses)
+        cursor = before if before is not None else after
+        if cursor is not None:
+            conditions.append(f"(start_datetime, reservation_id) {'<' if before is not None else '>'} (?, ?)")
+            parameters += [str(cursor[0]), to_sql_id(cursor[1])]
+        order = "DESC" if before is not None else "ASC"
+        rows = self.database.connection().execute(
+            f"SELECT * FROM reservations WHERE {' AND '.join(conditions)} ORDER BY start_datetime {order}, reservation_id {order} LIMIT ?",
+            parameters + [limit + 1],
+        ).fetchall()
+        page = [_reservation_from_row(row) for row in rows[:limit]]
+        if before is not None:
+            return page[::-1], len(rows) > limit, True
+        return page, after is not None, len(rows) > limit
+
+    def update_statuses(self, statuses:dict, archive_before:datetime=None):
+        """Update statuses in one transaction, moving old finished reservations to the archive table."""
+        with self.database.connection() as connection:
+            connection.executemany(UPDATE_RESERVATION_STATUS, ((status, to_sql_id(reservation_id)) for reservation_id, status in statuses.items()))
+            if archive_before is not None:
+                connection.execute(ARCHIVE_RESERVATIONS, (str(archive_before),))
+                connection.execute(DELETE_ARCHIVED_RESERVATIONS, (str(archive_before),))
+
+
+class SQLiteBikeStorage(BaseBikeStorage):
+    def __init__(self, database:SQLiteDatabase):
+        self.database = database
+
+    def add_bike(self, bike_id, size, name):
+        """Insert a new bike."""
+        with self.database.connection() as connection:
+            connection.execute(INSERT_BIKE, (int(bike_id), size, name))
+
+    def get_bike_by_id(self, bike_id):
+        """Retrieve a bike by its ID."""
+        row = self.database.connection().execute(SELECT_BIKE_BY_ID, (bike_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_bikes(self):
+        """List all bikes."""
+        return [dict(row) for row in self.database.connection().execute(SELECT_BIKES)]
+
+
+class SQLiteUserStorage(BaseUserStorage):
+    def __init__(self, database:SQLiteDatabase):
+        self.database = database
+        self.idempotency = IdempotencyCache()
+
+    def add_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
+        """Insert a new user."""
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.add_user, user_id, username, first_name, last_name, association, email)
+        with self.database.connection() as connection:
+            connection.execute(UPSERT_USER, (user_id, username, first_name, last_name, association, email))
+
+    def update_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
+        """Replace the stored details of a user."""
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.update_user, user_id, username, first_name, last_name, association, email)
+        with self.database.connection() as connection:
+            connection.execute(UPSERT_USER, (user_id, username, first_name, last_name, association, email))
+
+    def get_user_by_id(self, user_id):
+        """Retrieve a user by its ID."""
+        row = self.database.connection().execute(SELECT_USER_BY_ID, (user_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def list_users(self):
+        """List all users."""
+        return [dict(row) for row in self.database.connection().execute(SELECT_USERS)]
+
+
+def import_csv(database:SQLiteDatabase, storage_dir=os.path.join(dirname,'../storage')):
+    """Copy the CSV storage files found in storage_dir into the database."""
+    reservations_file = os.path.join(storage_dir, 'reservations.csv')
+    bikes_file = os.path.join(storage_dir, 'bikes.csv')
+    users_file = os.path.join(storage_dir, 'users.csv')
+    counts = {}
+    with database.connection() as connection:
+        if os.path.exists(reservations_file):
+            before = connection.total_changes
+            connection.executemany(
+                INSERT_RESERVATION.replace("INSERT", "INSERT OR REPLACE", 1),
+                ((to_sql_id(r['reservation_id']), r['user_id'], r['username'], r['first_name'], r['last_name'], r['association_name'], r['email'], r['bike_id'], str(r['start_datetime']), str(r['end_datetime']), r['status']) for r in ReservationStorage(reservations_file).iter_reservations()),
+            )
+            counts['reservations'] = connection.total_changes - before
+        if os.path.exists(bikes_file):
+            bikes = BikeStorage(bikes_file).list_bikes()
+            connection.executemany(
+                INSERT_BIKE.replace("INSERT", "INSERT OR REPLACE", 1),
+                [(b['bike_id'], b['size'], b['name']) for b in bikes],
+            )
+            counts['bikes'] = len(bikes)
+        if os.path.exists(users_file):
+            users = UserStorage(users_file).list_users()
+            connection.executemany(
+                UPSERT_USER,
+                [(u['user_id'], u['username'], u['first_name'], u['last_name'], u['association'], u['email']) for u in users],
+            )
+            counts['users'] = len(users)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import the CSV storage files into a SQLite database.")
+    parser.add_argument('--storage-dir', default=os.path.join(dirname,'../storage'), help="directory containing the CSV files")
+    parser.add_argument('--database', default=os.getenv("SQLITE_PATH", os.path.join(dirname,'../storage/bot.db')), help="SQLite database file")
+    args = parser.parse_args()
+    for table, count in import_csv(SQLiteDatabase(args.database), args.storage_dir).items():
+        print(f"Imported {count} {table}")
@@ -0,0 +1,125 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfile:
+    """Timeline of a process start: imports, storage builds and the first update.
+
+    Phases are durations (e.g. building one storage index), marks are times since
+    the profile was created, which ``main.py`` does before its other imports.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.marks = {}
+        self.reported = False
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def phase(self, name:str):
+        """Record the duration of the with-block under ``name``."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self.lock:
+                self.phases[name] = seconds
+            metrics.observe('bot_startup_seconds', seconds, phase=name)
+
+    def mark(self, name:str):
+        """Record the time since start under ``name``, the first time only; return whether it was new."""
+        seconds = self.elapsed()
+        with self.lock:
+            if name in self.marks:
+                return False
+            self.marks[name] = seconds
+        metrics.observe('bot_startup_seconds', seconds, phase=name)
+        return True
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'started_at': self.started_at,
+                'marks': dict(self.marks),
+                'phases': dict(self.phases),
+            }
+
+    def report(self):
+        """Return the profile as text, in the order things happened."""
+        with self.lock:
+            lines = [f"{name}: {seconds:.3f}s after start" for name, seconds in sorted(self.marks.items(), key=lambda item: item[1])]
+            lines += [f"{name}: took {seconds:.3f}s" for name, seconds in sorted(self.phases.items())]
+        return "Startup profile\n" + "\n".join(lines)
+
+    def save(self, filename:str):
+        """Append the profile as one JSON line, so successive restarts can be compared."""
+        with open(filename, 'a') as f:
+            f.write(json.dumps(self.to_dict()) + '\n')
+
+
+# Created when main.py starts importing, so marks include the import time
+startup = StartupProfile()
+
+
+class LazyInit:
+    """Object built by ``factory`` on first use or in the background.
+
+    ``start`` builds it on a daemon thread right away; otherwise the first ``get``
+    builds it. ``get`` waits until it is built, so only callers that need this object
+    wait for it. The build time is recorded in the startup profile.
+    """
+
+    def __init__(self, factory, name:str):
+        self._factory = factory
+        self._name = name
+        self._future = Future()
+        self._lock = threading.Lock()
+        self._building = False
+
+    def _build(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        try:
+            with startup.phase(f"build_{self._name}"):
+                value = self._factory()
+        except BaseException as e:
+            logger.exception("Failed to build %s", self._name)
+            self._future.set_exception(e)
+        else:
+            self._future.set_result(value)
+
+    def start(self):
+        """Build in the background, returning immediately."""
+        threading.Thread(target=self._build, name=f"build-{self._name}", daemon=True).start()
+
+    def ready(self):
+        return self._future.done()
+
+    @property
+    def future(self):
+        """Future of the built object; starts the build if nothing did yet."""
+        if not self._building:
+            self.start()
+        return self._future
+
+    def get(self):
+        """Return the built object, building it on this thread if no one started it."""
+        if not self._future.done():
+            self._build()
+        return self._future.result()
@@ -1,20 +1,593 @@
 import csv
+import gzip
+import io
+import json
+import logging
+import shutil
+import sys
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+import itertools
 import threading
+import time
 import uuid
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import os
 
+from idempotency import IdempotencyCache
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of the same process are coordinated
+    fcntl = None
+
 dirname = os.path.dirname(__file__)
+logger = logging.getLogger(__name__)
+
+RESERVATION_FIELDS = ['reservation_id', 'user_id', 'username', 'first_name', 'last_name', 'association_name', 'email', 'bike_id', 'start_datetime', 'end_datetime', 'status']
+USER_FIELDS = ['user_id', 'username', 'first_name', 'last_name', 'association', 'email']
+# update_user used to rewrite users.csv with this header, in the same column order
+LEGACY_USER_FIELDS = {'association_name': 'association'}
+# Reservations still to come or under way, and those that are over for good
+CURRENT_STATUSES = {'pending', 'accepted', 'active'}
+FINISHED_STATUSES = {'completed', 'expired', 'canceled', 'cancelled', 'rejected'}
+
+
+def parse_datetime(value:str):
+    """Parse a stored 'YYYY-MM-DD HH:MM:SS' timestamp.
+
+    ``datetime.fromisoformat`` is implemented in C and is an order of magnitude faster
+    than ``strptime``; it also accepts the fractional seconds ``str(datetime)`` emits.
+    """
+    return datetime.fromisoformat(value)
+
+
+class Reservation:
+    """Compact reservation record.
+
+    Slots instead of a per-row dict, and interned repeated strings, keep a fully
+    loaded table small. Records support the read-only mapping interface the rest of
+    the bot uses (``reservation['status']``, ``items()``, ``dict(reservation)``) and
+    are shared between callers, so they must not be modified; use ``replace``.
+    """
+
+    __slots__ = tuple(RESERVATION_FIELDS)
+
+    def __init__(self, reservation_id:int, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str):
+        self.reservation_id = reservation_id
+        self.user_id = user_id
+        self.username = sys.intern(username or '')
+        self.first_name = sys.intern(first_name or '')
+        self.last_name = sys.intern(last_name or '')
+        self.association_name = sys.intern(association_name or '')
+        self.email = sys.intern(email or '')
+        self.bike_id = bike_id
+        self.start_datetime = start_datetime
+        self.end_datetime = end_datetime
+        self.status = sys.intern(status)
+
+    @classmethod
+    def from_csv(cls, values):
+        """Build a record from the string cells of a CSV row."""
+        return cls(int(values[0]), int(values[1]), values[2], values[3], values[4], values[5], values[6], int(values[7]), parse_datetime(values[8]), parse_datetime(values[9]), values[10])
+
+    def as_row(self):
+        """Return the values in CSV column order."""
+        return [getattr(self, field) for field in RESERVATION_FIELDS]
+
+    def replace(self, **changes):
+        """Return a copy of the record with some fields changed."""
+        values = {field: getattr(self, field) for field in RESERVATION_FIELDS}
+        values.update(changes)
+        return Reservation(**values)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return list(RESERVATION_FIELDS)
+
+    def values(self):
+        return self.as_row()
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in RESERVATION_FIELDS]
+
+    def __iter__(self):
+        return iter(RESERVATION_FIELDS)
+
+    def __len__(self):
+        return len(RESERVATION_FIELDS)
+
+    def __contains__(self, key):
+        return key in RESERVATION_FIELDS
+
+    def __eq__(self, other):
+        if isinstance(other, Reservation):
+            return self.as_row() == other.as_row()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Reservation({', '.join(f'{field}={getattr(self, field)!r}' for field in RESERVATION_FIELDS)})"
+
+
+class RWLock:
+    """Shared/exclusive lock protecting one storage file.
+
+    Any number of threads may hold the read lock at once, while the write lock is
+    exclusive; waiting writers take precedence over new readers. The lock is mirrored
+    with ``flock`` on ``lock_filename`` (shared while this process has readers,
+    exclusive while it has a writer) so several processes can share the same files.
+    """
+
+    def __init__(self, lock_filename:str=None):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._lock_file = open(lock_filename, 'a') if lock_filename and fcntl else None
+
+    def _flock(self, operation:str):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file.fileno(), getattr(fcntl, operation))
+
+    @contextmanager
+    def read_lock(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            if self._readers == 0:
+                # Taken while holding the condition so no reader runs before the process holds the file lock
+                self._flock('LOCK_SH')
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._flock('LOCK_UN')
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            self._flock('LOCK_EX')
+            try:
+                yield
+            finally:
+                self._flock('LOCK_UN')
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class BatchWriter:
+    """Write-behind queue coalescing records from concurrent callers.
+
+    Records passed to ``write`` are handed to ``flush(records)`` by a background
+    thread in batches of up to ``max_batch``, gathered for at most ``flush_interval``
+    seconds. ``write`` returns once the flush containing its record has completed.
+    With a ``flush_interval`` of 0 a lone record is flushed right away, and the
+    records queued while a flush is running make up the next batch.
+    """
+
+    def __init__(self, flush, flush_interval:float=0.01, max_batch:int=100):
+        self.flush = flush
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """Queue a record and return a Future resolved once it has been flushed."""
+        future = Future()
+        with self._condition:
+            self._pending.append((record, future))
+            self._condition.notify()
+        return future
+
+    def write(self, record):
+        """Queue a record and wait until it has been flushed."""
+        return self.submit(record).result()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            try:
+                self.flush([record for record, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+
+
+def _read_lines(csvfile, size):
+    """Yield the decoded lines of a binary file up to byte offset size."""
+    while csvfile.tell() < size:
+        yield csvfile.readline().decode()
+
+
+def _user_reader(csvfile):
+    """DictReader over users.csv, naming the columns of legacy files as in USER_FIELDS."""
+    reader = csv.DictReader(csvfile)
+    if reader.fieldnames:
+        reader.fieldnames = [LEGACY_USER_FIELDS.get(name, name) for name in reader.fieldnames]
+    return reader
+
+
+def _append_csv_rows(filename, rows):
+    """Append rows to a CSV file and fsync it."""
+    with open(filename, 'a', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerows(rows)
+        csvfile.flush()
+        os.fsync(csvfile.fileno())
+
+
+def _replace_csv(filename, header, rows):
+    """Atomically replace a CSV file with the given rows."""
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+        csvfile.flush()
+        os.fsync(csvfile.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def _page(keys, reservations, limit:int, after=None, before=None, statuses=None):
+    """Cut one page out of reservations sorted by their ``(start_datetime, reservation_id)`` keys.
+
+    Only the page and the records skipped for their status are visited, whatever the
+    length of the list.
+    """
+    page = []
+    if before is not None:
+        i = bisect_left(keys, before) - 1
+        while i >= 0 and len(page) <= limit:
+            if statuses is None or reservations[i].status in statuses:
+                page.append(reservations[i])
+            i -= 1
+        return page[:limit][::-1], len(page) > limit, True
+    i = bisect_right(keys, after) if after is not None else 0
+    while i < len(reservations) and len(page) <= limit:
+        if statuses is None or reservations[i].status in statuses:
+            page.append(reservations[i])
+        i += 1
+    return page[:limit], after is not None, len(page) > limit
+
+
+# Files the archive index is split into, by reservation ID
+INDEX_SHARDS = 256
+
+
+class ReservationArchive:
+    """Finished reservations, partitioned by month of pickup.
+
+    Partition files live in one directory together with ``manifest.json``, which lists
+    the files of each month, and ``index/``, append-only maps from reservation ID to
+    month sharded by ID, so looking up an archived reservation reads one shard of the
+    index and a single month, without keeping the index in memory. Once a month
+    is over its files are sealed: made read-only and, if ``compress`` is set, gzipped.
+    Rows archived into a sealed month later on start a new file. The archive has no
+    lock of its own; callers hold the reservation storage's lock.
+    """
+
+    def __init__(self, directory:str, compress:bool=True):
+        self.directory = directory
+        self.compress = compress
+        self.manifest_filename = os.path.join(directory, 'manifest.json')
+        self.index_directory = os.path.join(directory, 'index')
+        # Single-file index written before it was sharded, split by the next add
+        self.legacy_index_filename = os.path.join(directory, 'index.csv')
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_filename) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'partitions': {}}
+
+    def _write_manifest(self, manifest):
+        tmp_filename = self.manifest_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.manifest_filename)
+
+    def _open(self, name:str):
+        path = os.path.join(self.directory, name)
+        if name.endswith('.gz'):
+            return gzip.open(path, 'rt', newline='')
+        return open(path, 'r', newline='')
+
+    def add(self, rows, seal_before:str=None):
+        """Append CSV rows to the partitions of their pickup month, then seal the months before seal_before ('YYYY-MM').
+
+        Rows whose reservation is already indexed are skipped, so archiving rows again,
+        e.g. after the hot file failed to be rewritten without them, is harmless.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        archived = self._indexed([values[0] for values in rows])
+        rows = [values for values in rows if values[0] not in archived]
+        manifest = self._read_manifest()
+        partitions = manifest['partitions']
+        by_month = defaultdict(list)
+        for values in rows:
+            by_month[values[8][:7]].append(values)
+        for month, month_rows in by_month.items():
+            files = partitions.setdefault(month, [])
+            if not files or files[-1]['sealed']:
+                files.append({'name': f"{month}.csv" if not files else f"{month}.{len(files)}.csv", 'rows': 0, 'sealed': False})
+            partition = files[-1]
+            path = os.path.join(self.directory, partition['name'])
+            if not os.path.exists(path):
+                _replace_csv(path, RESERVATION_FIELDS, [])
+            _append_csv_rows(path, month_rows)
+            partition['rows'] += len(month_rows)
+        self._add_to_index([values[0], values[8][:7]] for values in rows)
+        if os.path.exists(self.legacy_index_filename):
+            with open(self.legacy_index_filename, 'r', newline='') as f:
+                self._add_to_index(csv.reader(f))
+            os.remove(self.legacy_index_filename)
+        replaced = self._seal(partitions, seal_before) if seal_before else []
+        self._write_manifest(manifest)
+        # Sealed copies are only referenced once the manifest is written
+        for name in replaced:
+            os.remove(os.path.join(self.directory, name))
+
+    def _seal(self, partitions, seal_before:str):
+        replaced = []
+        for month, files in partitions.items():
+            if month >= seal_before:
+                continue
+            for partition in files:
+                if partition['sealed']:
+                    continue
+                path = os.path.join(self.directory, partition['name'])
+                if self.compress:
+                    with open(path, 'rb') as source, open(path + '.gz.tmp', 'wb') as target:
+                        with gzip.GzipFile(fileobj=target, mode='wb', mtime=0) as compressed:
+                            shutil.copyfileobj(source, compressed)
+                        target.flush()
+                        os.fsync(target.fileno())
+                    os.replace(path + '.gz.tmp', path + '.gz')
+                    replaced.append(partition['name'])
+                    partition['name'] += '.gz'
+                    path += '.gz'
+                os.chmod(path, 0o444)
+                partition['sealed'] = True
+        return replaced
+
+    def _index_shard(self, key:str):
+        return os.path.join(self.index_directory, f"{int(key) % INDEX_SHARDS:02x}.csv")
+
+    def _add_to_index(self, entries):
+        by_shard = defaultdict(list)
+        for reservation_id, month in entries:
+            by_shard[self._index_shard(reservation_id)].append((reservation_id, month))
+        os.makedirs(self.index_directory, exist_ok=True)
+        for filename, shard_entries in by_shard.items():
+            _append_csv_rows(filename, shard_entries)
+
+    def _indexed(self, keys):
+        """Return the reservation IDs among keys that the index lists, reading only their shards."""
+        wanted = set(keys)
+        by_shard = defaultdict(set)
+        for key in wanted:
+            by_shard[self._index_shard(key)].add(key)
+        found = set()
+        for filename, shard_keys in [*by_shard.items(), (self.legacy_index_filename, wanted)]:
+            try:
+                with open(filename, 'r', newline='') as f:
+                    found.update(reservation_id for reservation_id, _ in csv.reader(f) if reservation_id in shard_keys)
+            except FileNotFoundError:
+                pass
+        return found
+
+    def _month_of(self, key:str):
+        """Look a reservation ID up in its shard of the index, streaming it."""
+        for filename in (self._index_shard(key), self.legacy_index_filename):
+            try:
+                with open(filename, 'r', newline='') as f:
+                    for reservation_id, month in csv.reader(f):
+                        if reservation_id == key:
+                            return month
+            except FileNotFoundError:
+                pass
+        return None
+
+    def get(self, key:str):
+        """Return the archived reservation with this ID (as a string), or None."""
+        month = self._month_of(key)
+        if month is None:
+            return None
+        for partition in self._read_manifest()['partitions'].get(month, ()):
+            with self._open(partition['name']) as csvfile:
+                reader = csv.reader(csvfile)
+                next(reader, None)
+                for values in reader:
+                    if values[0] == key:
+                        return Reservation.from_csv(values)
+        return None
+
+    def open_partitions(self):
+        """Open every partition file in month order, with its current row count, for iter_partitions."""
+        partitions = self._read_manifest()['partitions']
+        return [(self._open(partition['name']), partition['rows']) for month in sorted(partitions) for partition in partitions[month]]
+
+    def iter_partitions(self, opened):
+        """Stream the rows of partitions returned by open_partitions, closing them."""
+        try:
+            for csvfile, rows in opened:
+                reader = csv.reader(csvfile)
+                next(reader, None)
+                for values in itertools.islice(reader, rows):
+                    yield Reservation.from_csv(values)
+        finally:
+            for csvfile, _ in opened:
+                csvfile.close()
+
+
+class BaseReservationStorage(ABC):
+    """Interface shared by all reservation storage backends.
+
+    Writes accept an ``idempotency_key``: a later write with the same key, e.g. a
+    replayed update, returns the first write's result without writing again.
+    """
+
+    @abstractmethod
+    def add_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending', idempotency_key:str=None):
+        """Save a new reservation and return its ID."""
+
+    def submit_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending'):
+        """Start saving a new reservation and return its ID with a Future resolved once it is saved.
+
+        Lets a caller holding its own lock release it before waiting for the write.
+        Saves right away unless the backend batches writes.
+        """
+        future = Future()
+        future.set_result(None)
+        return self.add_reservation(user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status), future
+
+    @abstractmethod
+    def get_reservation_by_id(self, reservation_id):
+        """Return the reservation with this ID, or None."""
+
+    @abstractmethod
+    def list_reservations(self):
+        """Return all reservations."""
+
+    @abstractmethod
+    def iter_reservations(self):
+        """Yield all reservations one at a time, without loading them all in memory."""
+
+    @abstractmethod
+    def list_reservations_for_user(self, user_id):
+        """Return all reservations of a user."""
+
+    @abstractmethod
+    def list_reservations_for_user_page(self, user_id, limit:int, after=None, before=None, statuses=None):
+        """Return one page of a user's reservations ordered by start_datetime.
+
+        ``after`` and ``before`` are ``(start_datetime, reservation_id)`` keyset cursors,
+        usually those of the last or first reservation of the page on display, and
+        ``statuses`` optionally restricts the statuses listed. Returns
+        ``(reservations, has_previous, has_next)``.
+        """
+
+    @abstractmethod
+    def update_statuses(self, statuses:dict, archive_before:datetime=None):
+        """Apply a batch of reservation_id -> status changes.
+
+        Finished reservations that ended before ``archive_before`` are moved out of the
+        hot data into the archive, which only ``iter_reservations`` and
+        ``get_reservation_by_id`` still read. Backends may defer the move to their
+        next compaction.
+        """
+
 
-class ReservationStorage:
-    def __init__(self, filename=os.path.join(dirname,'../storage/reservations.csv')):
+class BaseBikeStorage(ABC):
+    """Interface shared by all bike storage backends."""
+
+    @abstractmethod
+    def add_bike(self, bike_id, size, name):
+        """Save a new bike."""
+
+    @abstractmethod
+    def get_bike_by_id(self, bike_id):
+        """Return the bike with this ID, or None."""
+
+    @abstractmethod
+    def list_bikes(self):
+        """Return all bikes."""
+
+
+class BaseUserStorage(ABC):
+    """Interface shared by all user storage backends.
+
+    Writes accept an ``idempotency_key``, as in BaseReservationStorage.
+    """
+
+    @abstractmethod
+    def add_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
+        """Save a new user."""
+
+    @abstractmethod
+    def update_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
+        """Replace the stored details of a user, adding the user if they are not stored yet."""
+
+    @abstractmethod
+    def get_user_by_id(self, user_id):
+        """Return the user with this ID, or None."""
+
+    @abstractmethod
+    def list_users(self):
+        """Return all users."""
+
+
+class ReservationStorage(BaseReservationStorage):
+    """Reservation storage scanning the CSV file on every read.
+
+    If ``flush_interval`` is set, appends from concurrent callers are grouped by a
+    BatchWriter into one write and fsync per flush. A status change appends a copy of
+    the reservation with its new status, and reads keep the last record of each
+    reservation. ``compact`` rewrites the file with those records only, moving old
+    finished reservations to a ReservationArchive in the ``<name>-archive`` directory
+    next to it, so the file only keeps current reservations and reads scale with
+    them. ``update_statuses`` compacts once ``compact_threshold`` status records were
+    appended, or when its ``archive_before`` moved ``archive_interval`` past the last
+    compaction's.
+    """
+
+    def __init__(self, filename=os.path.join(dirname,'../storage/reservations.csv'), flush_interval:float=None, max_batch:int=100, compress_archive:bool=True, compact_threshold:int=1000, archive_interval:timedelta=timedelta(days=1)):
         self.filename = filename
-        self.lock = threading.Lock()
+        self.archive = ReservationArchive(os.path.splitext(filename)[0] + '-archive', compress_archive)
+        self.lock = RWLock(filename + '.lock')
+        self.idempotency = IdempotencyCache()
+        self._writer = BatchWriter(self._append_rows, flush_interval, max_batch) if flush_interval is not None else None
+        self.compact_threshold = compact_threshold
+        self.archive_interval = archive_interval
+        self._status_records = 0  # superseded records in the file, as far as this process knows
+        self._archived_before = None  # archive_before of the last compaction
         self._initialize_csv()
 
     def _initialize_csv(self):
         """Initialize the CSV file with a header if it doesn't exist."""
-        with self.lock:
+        with self.lock.write_lock():
             try:
                 with open(self.filename, 'x', newline='') as csvfile:
                     writer = csv.writer(csvfile)
@@ -22,68 +595,329 @@ class ReservationStorage:
             except FileExistsError:
                 pass
 
-    def add_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending'):
+    def add_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending', idempotency_key:str=None):
         """Add a new reservation to the CSV file."""
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.add_reservation, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        reservation_id, written = self.submit_reservation(user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status)
+        written.result()
+        return reservation_id
+
+    def submit_reservation(self, user_id:int, username:str, first_name:str, last_name:str, association_name:str, email:str, bike_id:int, start_datetime:datetime, end_datetime:datetime, status:str='pending'):
+        """Queue a new reservation on the batch writer and return its ID with the flush's Future."""
         reservation_id = int(uuid.uuid4().int >> 64)  # Convert UUID to a unique integer
-        with self.lock:
-            with open(self.filename, 'a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([reservation_id, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status])
+        row = [reservation_id, user_id, username, first_name, last_name, association_name, email, bike_id, start_datetime, end_datetime, status]
+        if self._writer is not None:
+            return reservation_id, self._writer.submit(row)
+        self._append_rows([row])
+        future = Future()
+        future.set_result(None)
+        return reservation_id, future
+
+    def _append_rows(self, rows):
+        with self.lock.write_lock():
+            _append_csv_rows(self.filename, rows)
 
     def get_reservation_by_id(self, reservation_id):
-        """Retrieve a reservation by its ID, converting ID to int."""
-        with self.lock:
-            with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if int(row['reservation_id']) == reservation_id:  # Convert CSV ID to int for comparison
-                        row['reservation_id'] = int(row['reservation_id'])  # Convert ID field back to int
-                        row['user_id'] = int(row['user_id'])
-                        row['bike_id'] = int(row['bike_id'])
-                        return row
-        return None
+        """Retrieve a reservation by its ID."""
+        key = str(reservation_id)
+        with self.lock.read_lock():
+            values = self._latest_rows({key}).get(key)
+        if values is not None:
+            return Reservation.from_csv(values)
+        return self._get_archived_reservation(key)
+
+    def _latest_rows(self, keys):
+        """Return the last row of each of these reservation IDs (strings) in the file, unparsed."""
+        rows = {}
+        with open(self.filename, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)
+            for values in reader:
+                if values[0] in keys:  # Only the matching rows are parsed
+                    rows[values[0]] = values
+        return rows
+
+    def _get_archived_reservation(self, key:str):
+        with self.lock.read_lock():
+            return self.archive.get(key)
+
+    def update_statuses(self, statuses:dict, archive_before:datetime=None):
+        """Append a record of each reservation whose status changes, compacting the file when due."""
+        with self.lock.write_lock():
+            updated = self._with_statuses(statuses)
+            if updated:
+                self._append_status_records(updated)
+            archive_due = archive_before is not None and (self._archived_before is None or archive_before - self._archived_before >= self.archive_interval)
+            if archive_due or (self.compact_threshold and self._status_records >= self.compact_threshold):
+                self._compact(archive_before)
+
+    def _with_statuses(self, statuses:dict):
+        """Return copies of the reservations whose status changes, with the new status."""
+        changes = {str(reservation_id): status for reservation_id, status in statuses.items()}
+        return [Reservation.from_csv(values).replace(status=changes[key]) for key, values in self._latest_rows(changes).items() if values[10] != changes[key]]
+
+    def _append_status_records(self, reservations):
+        _append_csv_rows(self.filename, [reservation.as_row() for reservation in reservations])
+        self._status_records += len(reservations)
+
+    def compact(self, archive_before:datetime=None):
+        """Rewrite the CSV file with the last record of each reservation, archiving finished ones that ended before archive_before."""
+        with self.lock.write_lock():
+            self._compact(archive_before)
+
+    def _compact(self, archive_before:datetime=None):
+        cutoff = str(archive_before) if archive_before is not None else None
+        latest = {}
+        with open(self.filename, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)
+            for values in reader:
+                latest[values[0]] = values
+        kept, archived = [], []
+        for values in latest.values():
+            # Stored timestamps are ISO formatted, so they compare correctly as strings
+            if cutoff is not None and values[10] in FINISHED_STATUSES and values[9] < cutoff:
+                archived.append(values)
+            else:
+                kept.append(values)
+        if archived:
+            # Months that ended a full month before the cutoff no longer receive rows.
+            # The archive skips rows it already has, should the replace below fail.
+            self.archive.add(archived, seal_before=str(archive_before - timedelta(days=31))[:7])
+        _replace_csv(self.filename, RESERVATION_FIELDS, kept)
+        self._status_records = 0
+        if archive_before is not None:
+            self._archived_before = archive_before
 
     def list_reservations(self):
-        """List all reservations, converting IDs to int."""
-        with self.lock:
-            reservations = []
+        """List all reservations."""
+        with self.lock.read_lock():
             with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    row['reservation_id'] = int(row['reservation_id'])
-                    row['user_id'] = int(row['user_id'])
-                    row['bike_id'] = int(row['bike_id'])
-                    row['start_datetime'] = datetime.strptime(row['start_datetime'], '%Y-%m-%d %H:%M:%S')
-                    row['end_datetime'] = datetime.strptime(row['end_datetime'], '%Y-%m-%d %H:%M:%S')
-                    reservations.append(row)
-            return reservations
+                reader = csv.reader(csvfile)
+                next(reader, None)
+                latest = {values[0]: values for values in reader}
+        return [Reservation.from_csv(values) for values in latest.values()]
+
+    def iter_reservations(self):
+        """Stream all reservations present when the iteration starts, archived ones first.
+
+        The current reservations are read twice: once to find the last record of
+        each, holding only their IDs, then to parse those records.
+        """
+        with self.lock.read_lock():
+            archived = self.archive.open_partitions()
+            csvfile = open(self.filename, 'rb')
+            size = os.fstat(csvfile.fileno()).st_size
+        yield from self.archive.iter_partitions(archived)
+        # Rows are only ever appended to the open file (compaction replaces it), so everything before `size` is stable
+        with csvfile:
+            reader = csv.reader(_read_lines(csvfile, size))
+            next(reader, None)
+            last = {values[0]: n for n, values in enumerate(reader)}
+            csvfile.seek(0)
+            reader = csv.reader(_read_lines(csvfile, size))
+            next(reader, None)
+            for n, values in enumerate(reader):
+                if last[values[0]] == n:
+                    yield Reservation.from_csv(values)
 
     def list_reservations_for_user(self, user_id):
-        """List all reservations for a specific user, converting IDs to int."""
-        with self.lock:
-            user_reservations = []
+        """List all reservations for a specific user."""
+        key = str(user_id)
+        with self.lock.read_lock():
             with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if int(row['user_id']) == user_id:  # Convert CSV ID to int for comparison
-                        row['reservation_id'] = int(row['reservation_id'])
-                        row['user_id'] = int(row['user_id'])
-                        row['bike_id'] = int(row['bike_id'])
-                        row['start_datetime'] = datetime.strptime(row['start_datetime'], '%Y-%m-%d %H:%M:%S')
-                        row['end_datetime'] = datetime.strptime(row['end_datetime'], '%Y-%m-%d %H:%M:%S')
-                        user_reservations.append(row)
-            return user_reservations
+                reader = csv.reader(csvfile)
+                next(reader, None)
+                latest = {values[0]: values for values in reader if values[1] == key}
+        return [Reservation.from_csv(values) for values in latest.values()]
+
+    def list_reservations_for_user_page(self, user_id, limit:int, after=None, before=None, statuses=None):
+        """Return one page of a user's reservations, scanning the current reservations only."""
+        reservations = sorted(self.list_reservations_for_user(user_id), key=lambda r: (r.start_datetime, r.reservation_id))
+        return _page([(r.start_datetime, r.reservation_id) for r in reservations], reservations, limit, after, before, statuses)
+
+
+class IndexedReservationStorage(ReservationStorage):
+    """Reservation storage that loads the CSV file once and serves reads from memory.
+
+    Reservations are indexed by ``reservation_id`` and by ``user_id``. Writes are
+    appended to the CSV file before the in-memory indexes are updated; a status
+    record replaces the reservation's record in them. The returned Reservation
+    records are shared with the indexes.
+
+    When several processes share the file, ``owns_user`` restricts the indexes to the
+    users this process serves; reads then only see those users' reservations, except
+    ``iter_reservations`` which streams the whole file.
+    """
+
+    def __init__(self, filename=os.path.join(dirname,'../storage/reservations.csv'), flush_interval:float=None, max_batch:int=100, owns_user=None, compress_archive:bool=True, compact_threshold:int=1000, archive_interval:timedelta=timedelta(days=1)):
+        self._reservations = {}
+        self._by_user = defaultdict(list)  # sorted by (start_datetime, reservation_id)
+        self._user_keys = defaultdict(list)  # the matching sort keys, for bisection
+        self._offset = 0  # bytes of the CSV file reflected in the indexes
+        self._inode = None  # the file is replaced, not truncated, by compaction
+        self.owns_user = owns_user
+        super().__init__(filename, flush_interval, max_batch, compress_archive, compact_threshold, archive_interval)
+        self._load()
+
+    def _load(self):
+        """Build the in-memory indexes from the CSV file."""
+        with self.lock.write_lock():
+            self._reload()
+
+    def _reload(self):
+        self._reservations.clear()
+        self._by_user.clear()
+        self._user_keys.clear()
+        self._status_records = 0
+        with open(self.filename, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            next(reader, None)
+            for values in reader:
+                self._index(Reservation.from_csv(values))
+            stat = os.fstat(csvfile.fileno())
+            self._offset = stat.st_size
+            self._inode = stat.st_ino
 
+    def _changed(self):
+        stat = os.stat(self.filename)
+        return stat.st_ino != self._inode or stat.st_size != self._offset
 
-class BikeStorage:
-    def __init__(self, filename=os.path.join(dirname,'../storage/bikes.csv')):
+    def _read_tail(self):
+        """Index the rows appended since the last read, e.g. by another process."""
+        stat = os.stat(self.filename)
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # The file was rewritten underneath us
+            self._reload()
+            return
+        if stat.st_size == self._offset:
+            return
+        with open(self.filename, 'rb') as csvfile:
+            csvfile.seek(self._offset)
+            data = csvfile.read()
+        data = data[:data.rfind(b'\n') + 1]
+        for values in csv.reader(io.StringIO(data.decode(), newline='')):
+            self._index(Reservation.from_csv(values))
+        self._offset += len(data)
+
+    def _sync(self):
+        if self._changed():
+            with self.lock.write_lock():
+                self._read_tail()
+
+    def _index(self, reservation):
+        if self.owns_user is not None and not self.owns_user(reservation.user_id):
+            return
+        previous = self._reservations.get(reservation.reservation_id)
+        if previous is not None:
+            # A later record of the same reservation, e.g. a status change, wins
+            self._status_records += 1
+            keys = self._user_keys[previous.user_id]
+            i = bisect_left(keys, (previous.start_datetime, previous.reservation_id))
+            del keys[i]
+            del self._by_user[previous.user_id][i]
+        self._reservations[reservation.reservation_id] = reservation
+        key = (reservation.start_datetime, reservation.reservation_id)
+        keys = self._user_keys[reservation.user_id]
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        self._by_user[reservation.user_id].insert(i, reservation)
+
+    def _append_rows(self, rows):
+        """Append rows to the CSV file and index them."""
+        with self.lock.write_lock():
+            self._read_tail()
+            _append_csv_rows(self.filename, rows)
+            self._offset = os.path.getsize(self.filename)
+            for row in rows:
+                self._index(Reservation(*row))
+
+    def _with_statuses(self, statuses:dict):
+        """Return copies of the indexed reservations whose status changes, with the new status."""
+        self._read_tail()
+        updated, missing = [], {}
+        for reservation_id, status in statuses.items():
+            reservation = self._reservations.get(int(reservation_id))
+            if reservation is None:
+                missing[reservation_id] = status
+            elif reservation.status != status:
+                updated.append(reservation.replace(status=status))
+        if missing:
+            # Reservations of users served by another process are not indexed here
+            updated += super()._with_statuses(missing)
+        return updated
+
+    def _append_status_records(self, reservations):
+        _append_csv_rows(self.filename, [reservation.as_row() for reservation in reservations])
+        self._offset = os.path.getsize(self.filename)
+        for reservation in reservations:
+            self._index(reservation)
+
+    def _compact(self, archive_before:datetime=None):
+        """Compact the CSV file and rebuild the indexes from it."""
+        super()._compact(archive_before)
+        self._reload()
+
+    def get_reservation_by_id(self, reservation_id):
+        """Retrieve a reservation by its ID."""
+        self._sync()
+        with self.lock.read_lock():
+            reservation = self._reservations.get(reservation_id)
+        if reservation is None:
+            return self._get_archived_reservation(str(reservation_id))
+        return reservation
+
+    def list_reservations(self):
+        """List all reservations."""
+        self._sync()
+        with self.lock.read_lock():
+            return list(self._reservations.values())
+
+    def iter_reservations(self):
+        """Yield the archived reservations, then the current ones from memory."""
+        if self.owns_user is not None:
+            yield from super().iter_reservations()
+            return
+        self._sync()
+        with self.lock.read_lock():
+            archived = self.archive.open_partitions()
+            reservations = list(self._reservations.values())
+        yield from self.archive.iter_partitions(archived)
+        yield from reservations
+
+    def list_reservations_for_user(self, user_id):
+        """List all reservations for a specific user."""
+        self._sync()
+        with self.lock.read_lock():
+            return list(self._by_user.get(user_id, ()))
+
+    def list_reservations_for_user_page(self, user_id, limit:int, after=None, before=None, statuses=None):
+        """Return one page of a user's reservations by bisecting the per-user index."""
+        self._sync()
+        with self.lock.read_lock():
+            return _page(self._user_keys.get(user_id, []), self._by_user.get(user_id, []), limit, after, before, statuses)
+
+
+class BikeStorage(BaseBikeStorage):
+    """Bike storage serving reads from an in-memory catalogue of the CSV file.
+
+    The catalogue is reloaded after ``add_bike`` or when the file's mtime changes;
+    the mtime is checked at most once every ``check_interval`` seconds.
+    """
+
+    def __init__(self, filename=os.path.join(dirname,'../storage/bikes.csv'), check_interval:float=1.0):
         self.filename = filename
-        self.lock = threading.Lock()
+        self.lock = RWLock(filename + '.lock')
+        self.check_interval = check_interval
+        self._bikes = None
+        self._mtime = None
+        self._checked_at = 0
         self._initialize_csv()
 
     def _initialize_csv(self):
         """Initialize the CSV file with a header if it doesn't exist."""
-        with self.lock:
+        with self.lock.write_lock():
             try:
                 with open(self.filename, 'x', newline='') as csvfile:
                     writer = csv.writer(csvfile)
@@ -91,91 +925,145 @@ class BikeStorage:
             except FileExistsError:
                 pass
 
+    def _catalogue(self):
+        """Return the bikes keyed by ID, reloading them if the file changed."""
+        now = time.monotonic()
+        if self._bikes is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            if self._bikes is None or os.stat(self.filename).st_mtime_ns != self._mtime:
+                with self.lock.read_lock():
+                    bikes = {}
+                    with open(self.filename, 'r', newline='') as csvfile:
+                        self._mtime = os.fstat(csvfile.fileno()).st_mtime_ns
+                        reader = csv.DictReader(csvfile)
+                        for row in reader:
+                            row['bike_id'] = int(row['bike_id'])
+                            bikes[row['bike_id']] = row
+                self._bikes = bikes
+        return self._bikes
+
     def add_bike(self, bike_id, size, name):
         """Add a new bike to the CSV file, ensuring bike_id is int."""
-        with self.lock:
+        with self.lock.write_lock():
             with open(self.filename, 'a', newline='') as csvfile:
                 writer = csv.writer(csvfile)
                 writer.writerow([int(bike_id), size, name])
+            self._bikes = None
 
     def get_bike_by_id(self, bike_id):
         """Retrieve a bike by its ID, ensuring IDs are treated as int."""
-        with self.lock:
-            with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    if int(row['bike_id']) == bike_id:  # Convert CSV ID to int for comparison
-                        row['bike_id'] = int(row['bike_id'])
-                        return row
-        return None
+        row = self._catalogue().get(bike_id)
+        return dict(row) if row is not None else None
 
     def list_bikes(self):
         """List all bikes, converting IDs to int."""
-        with self.lock:
-            bikes = []
-            with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    row['bike_id'] = int(row['bike_id'])
-                    bikes.append(row)
-            return bikes
+        return [dict(row) for row in self._catalogue().values()]
+
+class UserStorage(BaseUserStorage):
+    """User storage backed by an append-only CSV journal.
+
+    ``add_user`` and ``update_user`` both append a record; when the file is read the
+    last record for a ``user_id`` wins. Superseded records are dropped by ``compact``,
+    which runs once ``compact_threshold`` records have been appended and, optionally,
+    every ``compact_interval`` seconds from a background thread. If ``flush_interval``
+    is set, appends are grouped by a BatchWriter.
+    """
 
-class UserStorage:
-    def __init__(self, filename=os.path.join(dirname,'../storage/users.csv')):
+    def __init__(self, filename=os.path.join(dirname,'../storage/users.csv'), compact_threshold:int=1000, compact_interval:float=None, flush_interval:float=None, max_batch:int=100):
         self.filename = filename
-        self.lock = threading.Lock()
+        self.lock = RWLock(filename + '.lock')
+        self.idempotency = IdempotencyCache()
+        self._writer = BatchWriter(self._append_rows, flush_interval, max_batch) if flush_interval is not None else None
+        self.compact_threshold = compact_threshold
+        self.compact_interval = compact_interval
+        self._journal_records = 0
         self._initialize_csv()
-        
+        if compact_interval:
+            self._compact_thread = threading.Thread(target=self._compact_periodically, daemon=True)
+            self._compact_thread.start()
+
     def _initialize_csv(self):
         """Initialize the CSV file with a header if it doesn't exist."""
-        with self.lock:
+        with self.lock.write_lock():
             try:
                 with open(self.filename, 'x', newline='') as csvfile:
                     writer = csv.writer(csvfile)
-                    writer.writerow(['user_id', 'username', 'first_name', 'last_name', 'association', 'email'])
+                    writer.writerow(USER_FIELDS)
             except FileExistsError:
                 pass
-            
-    def add_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str):
+
+    def _write(self, row):
+        """Persist one journal record, through the batch writer if there is one."""
+        if self._writer is not None:
+            self._writer.write(row)
+        else:
+            self._append_rows([row])
+
+    def _append_rows(self, rows):
+        with self.lock.write_lock():
+            _append_csv_rows(self.filename, rows)
+            self._journal_records += len(rows)
+            if self.compact_threshold and self._journal_records >= self.compact_threshold:
+                try:
+                    self._compact()
+                except Exception:
+                    # The records are written; compacting is tried again on the next append
+                    logger.exception("Failed to compact %s", self.filename)
+
+    def _read_latest(self):
+        """Replay the journal, keeping the last record for each user."""
+        users = {}
+        with open(self.filename, 'r', newline='') as csvfile:
+            reader = _user_reader(csvfile)
+            for row in reader:
+                row['user_id'] = int(row['user_id'])
+                users[row['user_id']] = row
+        return users
+
+    def add_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
         """Add a new user to the CSV file."""
-        with self.lock:
-            with open(self.filename, 'a', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([user_id, username, first_name, last_name, association, email])
-        
-    def update_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str):
-        """Update an existing user in the CSV file."""
-        with self.lock:
-            with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                rows = list(reader)
-            with open(self.filename, 'w', newline='') as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(['user_id', 'username', 'first_name', 'last_name', 'association_name', 'email'])
-                for row in rows:
-                    if int(row['user_id']) == user_id:
-                        writer.writerow([user_id, username, first_name, last_name, association, email])
-                    else:
-                        writer.writerow(int(row['user_id']), row['username'], row['first_name'], row['last_name'], row['association_name'], row['email'])       
-                
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.add_user, user_id, username, first_name, last_name, association, email)
+        self._write([user_id, username, first_name, last_name, association, email])
+
+    def update_user(self, user_id:int, username:str, first_name:str, last_name:str, association:str, email:str, idempotency_key:str=None):
+        """Update a user, new or not, by appending a journal record."""
+        if idempotency_key is not None:
+            return self.idempotency.call(idempotency_key, self.update_user, user_id, username, first_name, last_name, association, email)
+        self._write([user_id, username, first_name, last_name, association, email])
+
+    def compact(self):
+        """Rewrite the CSV file with only the latest record for each user."""
+        with self.lock.write_lock():
+            self._compact()
+
+    def _compact(self):
+        users = self._read_latest()
+        _replace_csv(self.filename, USER_FIELDS, ([row[field] for field in USER_FIELDS] for row in users.values()))
+        self._journal_records = 0
+
+    def _compact_periodically(self):
+        while True:
+            time.sleep(self.compact_interval)
+            try:
+                self.compact()
+            except Exception:
+                # Keep the thread alive; the next round may succeed
+                logger.exception("Failed to compact %s", self.filename)
+
     def get_user_by_id(self, user_id):
         """Retrieve a user by its ID, converting ID to int."""
-        with self.lock:
+        with self.lock.read_lock():
+            user = None
             with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
+                reader = _user_reader(csvfile)
                 for row in reader:
                     if int(row['user_id']) == user_id:
                         row['user_id'] = int(row['user_id'])
-                        return row
-        return None
-    
+                        user = row
+        return user
+
     def list_users(self):
         """List all users, converting IDs to int."""
-        with self.lock:
-            users = []
-            with open(self.filename, 'r', newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    row['user_id'] = int(row['user_id'])
-                    users.append(row)
-            return users
+        with self.lock.read_lock():
+            return list(self._read_latest().values())
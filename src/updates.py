@@ -0,0 +1,50 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently, except those of one user, which run in order.
+
+    Up to ``max_concurrent_updates`` updates are handled at once, so a user waiting
+    on the outbound rate limiter or on storage does not hold up anyone else. Updates
+    from the same user (or, without a user, the same chat) queue behind each other
+    in arrival order, which keeps conversation states and ``user_data`` consistent.
+    """
+
+    def __init__(self, max_concurrent_updates:int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # key -> [lock, updates holding or waiting for it]
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock wakes its waiters first in, first out
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
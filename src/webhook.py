@@ -0,0 +1,142 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 1 << 20
+
+
+class WebhookServer:
+    """Minimal HTTP listener feeding POSTed updates into an Application's update queue.
+
+    Requests must be POSTs to ``url_path``; when ``secret_token`` is set they must also
+    carry it in the ``X-Telegram-Bot-Api-Secret-Token`` header, as Telegram does.
+    """
+
+    def __init__(self, application:Application, listen:str, port:int, url_path:str, secret_token:str=None):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.url_path = '/' + url_path.lstrip('/')
+        self.secret_token = secret_token
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        logger.info("Webhook listening on http://%s:%s%s", self.listen, self.port, self.url_path)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                try:
+                    method, path, headers = self._parse_head(head)
+                    body = await self._read_body(reader, headers)
+                except (ValueError, asyncio.LimitOverrunError):
+                    await self._respond(writer, 400, "Bad Request")
+                    break
+                if body is None:
+                    await self._respond(writer, 413, "Payload Too Large")
+                    break
+                status, reason = self._process(method, path, headers, body)
+                await self._respond(writer, status, reason)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception("Webhook connection failed")
+        finally:
+            writer.close()
+
+    def _parse_head(self, head:bytes):
+        """Split a request head into method, path and lower-cased headers; raise ValueError if malformed."""
+        request_line, *header_lines = head.decode('latin-1').split('\r\n')
+        method, path, _ = request_line.split(' ', 2)
+        headers = {}
+        for line in header_lines:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, path, headers
+
+    async def _read_body(self, reader:asyncio.StreamReader, headers:dict):
+        """Read a plain or chunked request body, or return None if it exceeds MAX_BODY_SIZE."""
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            size = 0
+            while True:
+                chunk_size = int((await reader.readuntil(b'\r\n')).split(b';', 1)[0], 16)
+                if chunk_size == 0:
+                    # Skip the trailer, which ends with an empty line
+                    while await reader.readuntil(b'\r\n') != b'\r\n':
+                        pass
+                    return b''.join(chunks)
+                size += chunk_size
+                if size > MAX_BODY_SIZE:
+                    return None
+                chunks.append(await reader.readexactly(chunk_size))
+                if await reader.readexactly(2) != b'\r\n':
+                    raise ValueError("Malformed chunk")
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY_SIZE:
+            return None
+        return await reader.readexactly(length)
+
+    def _process(self, method, path, headers, body):
+        if path.split('?', 1)[0] != self.url_path:
+            return 404, "Not Found"
+        if method != 'POST':
+            return 405, "Method Not Allowed"
+        if self.secret_token and not hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', ''), self.secret_token):
+            return 403, "Forbidden"
+        try:
+            self._deliver(json.loads(body), body)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.warning("Discarding malformed update: %r", body[:200])
+            return 400, "Bad Request"
+        except Exception:
+            logger.exception("Failed to deliver an update")
+            return 500, "Internal Server Error"
+        return 200, "OK"
+
+    def _deliver(self, payload:dict, body:bytes):
+        """Hand a decoded update over; raise ValueError, TypeError, KeyError or AttributeError if it is malformed."""
+        self.application.update_queue.put_nowait(Update.de_json(payload, self.application.bot))
+
+    async def _respond(self, writer:asyncio.StreamWriter, status:int, reason:str):
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n".encode('latin-1'))
+        await writer.drain()
+
+
+async def run_webhook(application:Application, listen:str, port:int, url_path:str, webhook_url:str=None, secret_token:str=None, allowed_updates=None):
+    """Serve updates through a local webhook listener until cancelled.
+
+    If webhook_url is given it is registered with Telegram; otherwise the listener only
+    receives what is POSTed to it locally, e.g. recorded updates.
+    """
+    server = WebhookServer(application, listen, port, url_path, secret_token)
+    async with application:
+        if webhook_url:
+            await application.bot.set_webhook(webhook_url, allowed_updates=allowed_updates, secret_token=secret_token)
+        await application.start()
+        await server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+            await application.stop()
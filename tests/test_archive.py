@@ -0,0 +1,100 @@
+import csv
+import os
+import stat
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage as storage_module
+from storage import IndexedReservationStorage, Reservation, ReservationArchive, ReservationStorage
+
+
+def row(reservation_id, start, status='completed'):
+    end = start + timedelta(hours=1)
+    return Reservation(reservation_id, 1, 'u', 'f', 'l', 'a', 'e', 1, start, end, status).as_row()
+
+
+def csv_row(reservation_id, start):
+    return [str(value) for value in row(reservation_id, start)]
+
+
+def test_rows_go_to_the_partition_of_their_month(tmp_path):
+    archive = ReservationArchive(str(tmp_path / 'archive'))
+    archive.add([csv_row(1, datetime(2030, 1, 5)), csv_row(2, datetime(2030, 2, 5)), csv_row(3, datetime(2030, 1, 20))])
+    partitions = archive._read_manifest()['partitions']
+    assert sorted(partitions) == ['2030-01', '2030-02']
+    assert partitions['2030-01'][0]['rows'] == 2
+    assert archive.get('2')['start_datetime'] == datetime(2030, 2, 5)
+    assert archive.get('4') is None
+
+
+def test_sealed_months_are_gzipped_read_only_and_still_readable(tmp_path):
+    archive = ReservationArchive(str(tmp_path / 'archive'))
+    archive.add([csv_row(1, datetime(2030, 1, 5))])
+    archive.add([csv_row(2, datetime(2030, 2, 5))], seal_before='2030-02')
+    january = archive._read_manifest()['partitions']['2030-01'][0]
+    assert january['sealed'] and january['name'] == '2030-01.csv.gz'
+    path = tmp_path / 'archive' / january['name']
+    assert not os.stat(path).st_mode & stat.S_IWUSR
+    assert not (tmp_path / 'archive' / '2030-01.csv').exists()
+    assert archive.get('1')['reservation_id'] == 1
+
+    # A late row for a sealed month starts a new file
+    archive.add([csv_row(3, datetime(2030, 1, 25))], seal_before='2030-02')
+    names = [partition['name'] for partition in archive._read_manifest()['partitions']['2030-01']]
+    assert names == ['2030-01.csv.gz', '2030-01.1.csv.gz']
+    assert [r['reservation_id'] for r in archive.iter_partitions(archive.open_partitions())] == [1, 3, 2]
+
+
+def test_index_is_sharded_and_a_legacy_index_is_migrated(tmp_path):
+    archive = ReservationArchive(str(tmp_path / 'archive'))
+    archive.add([csv_row(i, datetime(2030, 1, 1)) for i in range(1, 600)])
+    assert len(os.listdir(tmp_path / 'archive' / 'index')) == 256
+    archive.add([csv_row(1000, datetime(2030, 3, 1))])
+    # Archives written before the index was sharded have a single index.csv
+    shard = archive._index_shard('1000')
+    with open(shard, newline='') as f:
+        entries = [entry for entry in csv.reader(f) if entry[0] != '1000']
+    with open(shard, 'w', newline='') as f:
+        csv.writer(f).writerows(entries)
+    with open(tmp_path / 'archive' / 'index.csv', 'w', newline='') as f:
+        csv.writer(f).writerow(['1000', '2030-03'])
+    assert archive._month_of('1000') == '2030-03'
+    # 1000 is found in the legacy index, so it is not archived twice
+    archive.add([csv_row(1000, datetime(2030, 3, 1)), csv_row(1001, datetime(2030, 3, 2))])
+    assert not (tmp_path / 'archive' / 'index.csv').exists()
+    assert archive._read_manifest()['partitions']['2030-03'][0]['rows'] == 2
+    assert archive.get('1000')['reservation_id'] == 1000
+    assert archive.get('599')['reservation_id'] == 599
+
+
+@pytest.mark.parametrize('cls', [ReservationStorage, IndexedReservationStorage])
+def test_update_statuses_moves_old_finished_reservations_to_the_archive(tmp_path, cls):
+    storage = cls(str(tmp_path / 'reservations.csv'))
+    old = storage.add_reservation(1, 'u', 'f', 'l', 'a', 'e', 1, datetime(2030, 1, 1), datetime(2030, 1, 1, 1), 'active')
+    current = storage.add_reservation(1, 'u', 'f', 'l', 'a', 'e', 1, datetime(2030, 3, 1), datetime(2030, 3, 1, 1), 'accepted')
+    storage.update_statuses({old: 'completed'}, archive_before=datetime(2030, 2, 1))
+    assert [r['reservation_id'] for r in storage.list_reservations()] == [current]
+    assert storage.get_reservation_by_id(old)['status'] == 'completed'
+    assert sorted(r['reservation_id'] for r in storage.iter_reservations()) == sorted([old, current])
+
+
+@pytest.mark.parametrize('cls', [ReservationStorage, IndexedReservationStorage])
+def test_archiving_again_after_a_failed_rewrite_adds_no_duplicates(tmp_path, cls, monkeypatch):
+    storage = cls(str(tmp_path / 'reservations.csv'))
+    old = storage.add_reservation(1, 'u', 'f', 'l', 'a', 'e', 1, datetime(2030, 1, 1), datetime(2030, 1, 1, 1), 'completed')
+    current = storage.add_reservation(1, 'u', 'f', 'l', 'a', 'e', 1, datetime(2030, 3, 1), datetime(2030, 3, 1, 1), 'accepted')
+    replace_csv = storage_module._replace_csv
+
+    def fail_once(filename, header, rows):
+        if filename == storage.filename:
+            monkeypatch.setattr(storage_module, '_replace_csv', replace_csv)
+            raise OSError("disk full")
+        return replace_csv(filename, header, rows)
+
+    monkeypatch.setattr(storage_module, '_replace_csv', fail_once)
+    with pytest.raises(OSError):
+        storage.update_statuses({}, archive_before=datetime(2030, 2, 1))
+    storage.update_statuses({}, archive_before=datetime(2030, 2, 1))
+    assert [r['reservation_id'] for r in storage.list_reservations()] == [current]
+    assert sorted(r['reservation_id'] for r in storage.iter_reservations()) == sorted([old, current])
@@ -0,0 +1,64 @@
+import random
+from datetime import datetime, timedelta
+
+from availability import BikeAvailability
+from storage import ReservationStorage
+
+T0 = datetime(2030, 1, 1)
+
+
+def at(hours):
+    return T0 + timedelta(hours=hours)
+
+
+def make_availability(tmp_path):
+    return BikeAvailability(ReservationStorage(str(tmp_path / 'reservations.csv')))
+
+
+def book(availability, bike_id, start, end, status='accepted'):
+    return availability.reserve(1, 'user', 'U', 'U', 'a', 'e', bike_id, at(start), at(end), status)
+
+
+def test_overlaps_are_rejected_and_touching_intervals_allowed(tmp_path):
+    availability = make_availability(tmp_path)
+    assert book(availability, 1, 10, 12) is not None
+    assert book(availability, 1, 11, 13) is None
+    assert book(availability, 1, 9, 10.5) is None
+    assert book(availability, 1, 12, 13) is not None  # [start, end) intervals only touch
+    assert book(availability, 1, 8, 10) is not None
+    assert book(availability, 2, 10, 12) is not None  # other bikes are independent
+
+
+def test_long_interval_is_seen_past_later_short_ones(tmp_path):
+    availability = make_availability(tmp_path)
+    book(availability, 1, 0, 100)
+    assert not availability.is_available(1, at(50), at(51))
+    assert availability.is_available(1, at(100), at(101))
+
+
+def test_released_statuses_do_not_hold_the_bike(tmp_path):
+    availability = make_availability(tmp_path)
+    assert book(availability, 1, 10, 12, status='cancelled') is not None
+    assert availability.is_available(1, at(10), at(12))
+
+
+def test_index_is_rebuilt_from_storage(tmp_path):
+    book(make_availability(tmp_path), 1, 10, 12)
+    availability = make_availability(tmp_path)
+    assert not availability.is_available(1, at(11), at(11.5))
+    assert availability.available_bikes([3, 1, 2], at(11), at(11.5)) == [3, 2]
+
+
+def test_matches_a_linear_scan(tmp_path):
+    availability = make_availability(tmp_path)
+    rng = random.Random(7)
+    booked = []
+    for _ in range(300):
+        bike_id = rng.randrange(3)
+        start = rng.randrange(200)
+        end = start + rng.randrange(1, 20)
+        free = all(b != bike_id or e <= start or s >= end for b, s, e in booked)
+        assert availability.is_available(bike_id, at(start), at(end)) == free
+        assert (book(availability, bike_id, start, end) is not None) == free
+        if free:
+            booked.append((bike_id, start, end))
@@ -0,0 +1,74 @@
+import threading
+
+import pytest
+
+from storage import BatchWriter
+
+
+class BlockingFlush:
+    """flush callback that holds its first call until released, recording every batch."""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, records):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(records)
+        if self.fail_on in records:
+            raise OSError("disk full")
+
+
+def test_records_queued_during_a_flush_share_the_next_one():
+    flush = BlockingFlush()
+    writer = BatchWriter(flush, flush_interval=0)
+    first = writer.submit(1)
+    assert flush.started.wait(5)
+    later = [writer.submit(record) for record in (2, 3, 4)]
+    flush.release.set()
+    for future in [first] + later:
+        future.result(5)
+    assert flush.batches == [[1], [2, 3, 4]]
+
+
+def test_batches_are_capped_at_max_batch():
+    flush = BlockingFlush()
+    writer = BatchWriter(flush, flush_interval=0, max_batch=2)
+    first = writer.submit(0)
+    assert flush.started.wait(5)
+    later = [writer.submit(record) for record in range(1, 6)]
+    flush.release.set()
+    for future in [first] + later:
+        future.result(5)
+    assert flush.batches == [[0], [1, 2], [3, 4], [5]]
+
+
+def test_flush_interval_gathers_records():
+    flush = BlockingFlush()
+    flush.release.set()
+    writer = BatchWriter(flush, flush_interval=0.2)
+    threads = [threading.Thread(target=writer.write, args=(record,)) for record in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert [sorted(batch) for batch in flush.batches] == [[0, 1, 2]]
+
+
+def test_a_failed_flush_fails_its_records_only():
+    flush = BlockingFlush(fail_on=2)
+    writer = BatchWriter(flush, flush_interval=0)
+    first = writer.submit(1)
+    assert flush.started.wait(5)
+    failed = [writer.submit(record) for record in (2, 3)]
+    flush.release.set()
+    assert first.result(5) is None
+    for future in failed:
+        with pytest.raises(OSError, match="disk full"):
+            future.result(5)
+    # The writer keeps going after a failure
+    writer.write(4)
+    assert flush.batches[-1] == [4]
@@ -0,0 +1,85 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from availability import BikeAvailability
+from idempotency import IdempotencyCache
+from storage import ReservationStorage
+
+
+def test_add_reports_new_keys_once():
+    cache = IdempotencyCache()
+    assert cache.add('a')
+    assert not cache.add('a')
+    assert cache.add('b')
+
+
+def test_least_recently_used_key_is_evicted():
+    cache = IdempotencyCache(max_size=2)
+    cache.add('a')
+    cache.add('b')
+    assert not cache.add('a')  # touches a, so b is now the oldest
+    cache.add('c')
+    assert cache.add('b')
+    assert not cache.add('c')
+
+
+def test_ttl_applies_after_a_hit():
+    cache = IdempotencyCache(ttl=0.2)
+    cache.add('a')
+    time.sleep(0.1)
+    cache.add('b')
+    assert not cache.add('a')  # a moves behind b
+    time.sleep(0.12)
+    assert cache.add('a')
+
+
+def test_call_runs_once_per_key():
+    cache = IdempotencyCache()
+    calls = []
+    assert cache.call('k', lambda: calls.append(1) or len(calls)) == 1
+    assert cache.call('k', lambda: calls.append(1) or len(calls)) == 1
+    assert calls == [1]
+
+
+def test_concurrent_calls_share_the_result():
+    cache = IdempotencyCache()
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.05)
+        return 'done'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.call('k', slow))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['done'] * 8
+    assert calls == [1]
+
+
+def test_failed_call_is_forgotten():
+    cache = IdempotencyCache()
+    with pytest.raises(ZeroDivisionError):
+        cache.call('k', lambda: 1 / 0)
+    assert cache.call('k', lambda: 2) == 2
+
+
+def test_conflict_does_not_block_the_key(tmp_path):
+    availability = BikeAvailability(ReservationStorage(str(tmp_path / 'reservations.csv')))
+    start = datetime(2030, 1, 1, 10)
+    end = start + timedelta(hours=1)
+    assert availability.reserve(2, 'other', 'O', 'O', 'a', 'e', 1, start, end, 'accepted') is not None
+
+    assert availability.reserve(1, 'user', 'U', 'U', 'a', 'e', 1, start, end, 'accepted', idempotency_key='1:99') is None
+    reservation_id = availability.reserve(1, 'user', 'U', 'U', 'a', 'e', 2, start, end, 'accepted', idempotency_key='1:99')
+    assert reservation_id is not None
+    # A replay of the successful booking returns it instead of conflicting with it
+    assert availability.reserve(1, 'user', 'U', 'U', 'a', 'e', 2, start, end, 'accepted', idempotency_key='1:99') == reservation_id
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from outbound import OutboundScheduler
+
+
+class FakeApi:
+    """Bot API callback recording the requests sent, answering 429 to the first ``limited`` ones."""
+
+    def __init__(self, limited:int=0, retry_after:float=0.05):
+        self.limited = limited
+        self.retry_after = retry_after
+        self.sent = []
+
+    def request(self, scheduler, chat_id, text):
+        async def callback():
+            if self.limited:
+                self.limited -= 1
+                raise RetryAfter(self.retry_after)
+            self.sent.append((chat_id, text))
+            return text
+        return scheduler.process_request(callback, (), {}, 'sendMessage', {'chat_id': chat_id, 'text': text}, None)
+
+
+def test_429_pauses_and_retries():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=10)
+    api = FakeApi(limited=2)
+
+    async def main():
+        started = time.monotonic()
+        result = await api.request(scheduler, 1, 'hello')
+        return result, time.monotonic() - started
+
+    result, seconds = asyncio.run(main())
+    assert result == 'hello'
+    assert api.sent == [(1, 'hello')]
+    assert seconds >= 0.09
+
+
+def test_gives_up_after_max_retries():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=10, max_retries=1)
+    api = FakeApi(limited=2, retry_after=0.01)
+    with pytest.raises(RetryAfter):
+        asyncio.run(api.request(scheduler, 1, 'hello'))
+    assert api.sent == []
+
+
+def test_chat_requests_keep_their_order_across_retries():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=1000, chat_burst=10)
+    api = FakeApi(limited=1)
+
+    async def main():
+        await asyncio.gather(*(api.request(scheduler, 1, n) for n in range(5)))
+
+    asyncio.run(main())
+    assert api.sent == [(1, n) for n in range(5)]
+
+
+def test_throttled_chat_does_not_hold_up_others():
+    scheduler = OutboundScheduler(global_rate=1000, chat_rate=20, chat_burst=1)
+    api = FakeApi()
+
+    async def main():
+        busy = [asyncio.create_task(api.request(scheduler, 1, n)) for n in range(8)]
+        await asyncio.sleep(0)
+        started = time.monotonic()
+        await api.request(scheduler, 2, 'other')
+        other_seconds = time.monotonic() - started
+        await asyncio.gather(*busy)
+        return other_seconds, time.monotonic() - started
+
+    other_seconds, busy_seconds = asyncio.run(main())
+    assert other_seconds < 0.05
+    assert busy_seconds >= 0.3
+    assert [text for chat_id, text in api.sent if chat_id == 1] == list(range(8))
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from sqlite_storage import SQLiteDatabase, SQLiteReservationStorage
+from storage import IndexedReservationStorage, ReservationStorage, _page
+
+T0 = datetime(2030, 1, 1)
+STATUSES = ['accepted', 'completed', 'accepted', 'pending', 'accepted']
+
+
+@pytest.fixture(params=['csv', 'indexed', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteReservationStorage(SQLiteDatabase(str(tmp_path / 'bot.db')))
+    cls = IndexedReservationStorage if request.param == 'indexed' else ReservationStorage
+    return cls(str(tmp_path / 'reservations.csv'))
+
+
+def fill(storage, user_id=1, count=23):
+    for i in range(count):
+        # Pairs of reservations share a start, so the ID breaks ties
+        start = T0 + timedelta(hours=i // 2)
+        storage.add_reservation(user_id, 'u', 'f', 'l', 'a', 'e', i % 3, start, start + timedelta(hours=1), STATUSES[i % len(STATUSES)])
+    storage.add_reservation(user_id + 1, 'u', 'f', 'l', 'a', 'e', 1, T0, T0 + timedelta(hours=1), 'accepted')
+
+
+def key(reservation):
+    return (reservation['start_datetime'], reservation['reservation_id'])
+
+
+def expected(storage, statuses=None):
+    reservations = sorted(storage.list_reservations_for_user(1), key=key)
+    return [key(r) for r in reservations if statuses is None or r['status'] in statuses]
+
+
+def walk_forward(storage, limit, statuses=None):
+    pages = []
+    after = None
+    while True:
+        page, has_previous, has_next = storage.list_reservations_for_user_page(1, limit, after=after, statuses=statuses)
+        assert has_previous == (after is not None)
+        pages.append([key(r) for r in page])
+        if not has_next:
+            return pages
+        after = key(page[-1])
+
+
+@pytest.mark.parametrize('statuses', [None, {'accepted', 'pending'}])
+def test_forward_pages_cover_the_user_in_order(storage, statuses):
+    fill(storage)
+    pages = walk_forward(storage, 5, statuses)
+    listed = [k for page in pages for k in page]
+    # Ties on start_datetime may be broken differently by each backend, but consistently
+    assert [start for start, _ in listed] == [start for start, _ in expected(storage, statuses)]
+    assert sorted(listed) == expected(storage, statuses)
+    assert all(len(page) == 5 for page in pages[:-1])
+    assert pages[-1]
+
+
+def test_backward_pages_mirror_forward_pages(storage):
+    fill(storage)
+    forward = walk_forward(storage, 5)
+    backward = []
+    # Start from the last page, as the "previous" button does
+    page, has_previous, has_next = storage.list_reservations_for_user_page(1, 5, after=forward[-2][-1])
+    backward.append([key(r) for r in page])
+    while has_previous:
+        before = key(page[0])
+        page, has_previous, has_next = storage.list_reservations_for_user_page(1, 5, before=before)
+        assert has_next
+        backward.append([key(r) for r in page])
+    assert backward[::-1] == forward
+
+
+def test_empty_user(storage):
+    assert storage.list_reservations_for_user_page(42, 5) == ([], False, False)
+
+
+def test_page_helper_stops_at_the_limit():
+    keys = [(T0, i) for i in range(10)]
+    records = [type('R', (), {'status': 'accepted'})() for _ in keys]
+    page, has_previous, has_next = _page(keys, records, 3, after=(T0, 4))
+    assert page == records[5:8] and has_previous and has_next
+    page, has_previous, has_next = _page(keys, records, 3, before=(T0, 2))
+    assert page == records[:2] and not has_previous and has_next
@@ -0,0 +1,55 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from reminders import ReservationTimers
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, name=None):
+        job = SimpleNamespace(callback=callback, when=when, schedule_removal=lambda: None)
+        self.jobs.append(job)
+        return job
+
+
+class FlakyStorage:
+    """Async reservation storage whose first read fails."""
+
+    def __init__(self, reservations):
+        self.reservations = {r['reservation_id']: r for r in reservations}
+        self.failures = 1
+        self.updates = []
+
+    async def get_reservation_by_id(self, reservation_id):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk unavailable")
+        return self.reservations.get(reservation_id)
+
+    async def update_statuses(self, statuses, archive_before=None):
+        self.updates.append(statuses)
+        for reservation_id, status in statuses.items():
+            self.reservations[reservation_id]['status'] = status
+
+
+def test_failed_read_keeps_the_events_and_the_timer():
+    now = datetime.now()
+    reservation = {'reservation_id': 7, 'user_id': 1, 'bike_id': 2, 'status': 'accepted', 'start_datetime': now - timedelta(minutes=5), 'end_datetime': now + timedelta(hours=1)}
+    storage = FlakyStorage([reservation])
+    timers = ReservationTimers(storage, remind_before=timedelta(hours=1))
+    job_queue = FakeJobQueue()
+    timers.start(job_queue)
+    timers.load([reservation])
+    context = SimpleNamespace(bot=SimpleNamespace(send_message=None))
+
+    asyncio.run(timers._run(context))
+    assert storage.updates == []
+    assert len(job_queue.jobs) == 2  # re-armed for the retry
+
+    # The retry is due one batch window later; run it as if that time had come
+    timers._heap = sorted((now if when < now + timedelta(minutes=2) else when, *rest) for when, *rest in timers._heap)
+    asyncio.run(timers._run(context))
+    assert storage.updates == [{7: 'active'}]
@@ -0,0 +1,73 @@
+import csv
+import gzip
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from reports import ReservationReport, export_csv, summarize
+from storage import RESERVATION_FIELDS, Reservation, ReservationStorage
+
+
+def reservation(reservation_id, bike_id, start, hours, association='Rowing', status='completed'):
+    return Reservation(reservation_id, 1, 'u', 'f', 'l', association, 'e', bike_id, start, start + timedelta(hours=hours), status)
+
+
+RESERVATIONS = [
+    reservation(1, 10, datetime(2030, 1, 7, 9), 2),                         # Monday
+    reservation(2, 10, datetime(2030, 1, 8, 9), 1, status='expired'),       # Tuesday
+    reservation(3, 20, datetime(2030, 1, 9, 14), 3, association='Chess'),   # Wednesday
+]
+
+
+def test_aggregates():
+    report = ReservationReport.from_reservations(RESERVATIONS)
+    assert report.total == 3
+    assert report.first_start == datetime(2030, 1, 7, 9) and report.last_start == datetime(2030, 1, 9, 14)
+    assert report.by_status == {'completed': 2, 'expired': 1}
+    assert report.bookings_per_bike == {10: 2, 20: 1}
+    assert report.hours_per_bike[10] == 3
+    assert report.bookings_per_association.most_common(1) == [('Rowing', 2)]
+    assert report.bookings_per_hour[9] == 2 and report.bookings_per_hour[14] == 1
+    assert report.bookings_per_weekday[:3] == [1, 1, 1]
+    # 3 hours booked over the 53 hours between the first and last pickup
+    assert report.utilization(10) == pytest.approx(3 / 53)
+    assert report.utilization(30) == 0
+
+
+def test_summary_text():
+    text = ReservationReport.from_reservations(RESERVATIONS).summary_text(top=1)
+    assert text.splitlines()[0] == "Reservations: 3 (07/01/2030 - 09/01/2030)"
+    assert "  10: 2, 3.0h, 5.7%" in text
+    assert "Top 1 associations:\n  Rowing: 2" in text
+    assert "Peak pickup hours: 09h (2), 14h (1)" in text
+    assert ReservationReport().summary_text() == "No reservations."
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = ReservationStorage(str(tmp_path / 'reservations.csv'))
+    for r in RESERVATIONS:
+        storage.add_reservation(r.user_id, r.username, r.first_name, r.last_name, r.association_name, r.email, r.bike_id, r.start_datetime, r.end_datetime, r.status)
+    return storage
+
+
+def test_summarize_includes_the_archive(storage):
+    storage.compact(archive_before=datetime(2030, 1, 8))
+    assert len(storage.list_reservations()) == 2
+    assert summarize(storage).startswith("Reservations: 3 ")
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_export_csv(storage, compress):
+    output = io.BytesIO()
+    assert export_csv(storage, output, compress) == 3
+    # The output stays open for the caller, e.g. to check its size
+    assert not output.closed
+    data = output.getvalue()
+    if compress:
+        data = gzip.decompress(data)
+    rows = list(csv.reader(io.StringIO(data.decode())))
+    assert rows[0] == RESERVATION_FIELDS
+    assert [row[7] for row in rows[1:]] == ['10', '10', '20']
+    assert rows[1][8] == '2030-01-07 09:00:00'
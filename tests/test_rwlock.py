@@ -0,0 +1,106 @@
+import subprocess
+import sys
+import threading
+import time
+
+from storage import RWLock
+
+
+def test_readers_share_the_lock(tmp_path):
+    lock = RWLock(str(tmp_path / 'file.lock'))
+    inside = threading.Barrier(3, timeout=2)
+
+    def read():
+        with lock.read_lock():
+            inside.wait()  # only passes if all three readers hold the lock together
+
+    threads = [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not inside.broken
+
+
+def test_writer_excludes_readers_and_writers(tmp_path):
+    lock = RWLock(str(tmp_path / 'file.lock'))
+    events = []
+
+    def write(name):
+        with lock.write_lock():
+            events.append(f"{name} in")
+            time.sleep(0.02)
+            events.append(f"{name} out")
+
+    def read(name):
+        with lock.read_lock():
+            events.append(f"{name} in")
+            events.append(f"{name} out")
+
+    threads = [threading.Thread(target=write, args=(f"w{i}",)) for i in range(3)]
+    threads += [threading.Thread(target=read, args=(f"r{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every writer's in/out pair is adjacent: nothing ran while it held the lock
+    for i, event in enumerate(events):
+        if event.startswith('w') and event.endswith(' in'):
+            assert events[i + 1] == event.replace(' in', ' out')
+
+
+def test_waiting_writer_goes_before_new_readers(tmp_path):
+    lock = RWLock(str(tmp_path / 'file.lock'))
+    order = []
+    reader_in = threading.Event()
+    release_reader = threading.Event()
+
+    def first_reader():
+        with lock.read_lock():
+            reader_in.set()
+            release_reader.wait(2)
+
+    def writer():
+        with lock.write_lock():
+            order.append('writer')
+
+    def late_reader():
+        with lock.read_lock():
+            order.append('late reader')
+
+    threads = [threading.Thread(target=first_reader)]
+    threads[0].start()
+    reader_in.wait(2)
+    threads.append(threading.Thread(target=writer))
+    threads[1].start()
+    time.sleep(0.05)  # the writer is now waiting
+    threads.append(threading.Thread(target=late_reader))
+    threads[2].start()
+    time.sleep(0.05)
+    release_reader.set()
+    for thread in threads:
+        thread.join()
+    assert order == ['writer', 'late reader']
+
+
+def test_write_lock_excludes_other_processes(tmp_path):
+    lock_filename = str(tmp_path / 'file.lock')
+    lock = RWLock(lock_filename)
+    probe = (
+        "import fcntl, sys\n"
+        "f = open(sys.argv[1], 'a')\n"
+        "try:\n"
+        "    fcntl.flock(f.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)\n"
+        "    print('free')\n"
+        "except BlockingIOError:\n"
+        "    print('locked')\n"
+    )
+
+    def other_process_sees():
+        return subprocess.run([sys.executable, '-c', probe, lock_filename], capture_output=True, text=True).stdout.strip()
+
+    with lock.write_lock():
+        assert other_process_sees() == 'locked'
+    with lock.read_lock():
+        assert other_process_sees() == 'free'
+    assert other_process_sees() == 'free'
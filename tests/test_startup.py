@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_storage import AsyncStorage
+from startup import LazyInit, StartupProfile, startup
+
+
+class Factory:
+    """Counts builds and records the thread they ran on, optionally holding them until released."""
+
+    def __init__(self, value=None, error=None, hold=False):
+        self.value = value
+        self.error = error
+        self.calls = 0
+        self.threads = []
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.threads.append(threading.current_thread().name)
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def test_start_builds_once_in_the_background():
+    factory = Factory('storage', hold=True)
+    lazy = LazyInit(factory, 'test_background')
+    lazy.start()
+    assert not lazy.ready()
+    factory.release.set()
+    assert lazy.get() == 'storage'
+    assert lazy.get() == 'storage'
+    assert factory.calls == 1
+    assert factory.threads == ['build-test_background']
+    assert 'build_test_background' in startup.phases
+
+
+def test_get_builds_on_the_calling_thread_if_nothing_started():
+    factory = Factory('storage')
+    lazy = LazyInit(factory, 'test_get')
+    assert lazy.get() == 'storage'
+    assert factory.threads == [threading.current_thread().name]
+    assert lazy.ready()
+
+
+def test_future_starts_the_build():
+    factory = Factory('storage')
+    lazy = LazyInit(factory, 'test_future')
+    assert lazy.future.result(5) == 'storage'
+    assert factory.calls == 1
+
+
+def test_build_errors_reach_every_caller():
+    lazy = LazyInit(Factory(error=OSError("no disk")), 'test_error')
+    with pytest.raises(OSError, match="no disk"):
+        lazy.get()
+    with pytest.raises(OSError, match="no disk"):
+        lazy.future.result(5)
+
+
+def test_async_storage_waits_for_the_build_without_a_storage_thread():
+    class Storage:
+        def list_bikes(self):
+            return ['bike']
+
+    factory = Factory(Storage(), hold=True)
+    lazy = LazyInit(factory, 'test_async')
+    executor = ThreadPoolExecutor(1)
+    storage = AsyncStorage(lazy, executor, 'bikes')
+
+    async def main():
+        lazy.start()
+        call = asyncio.ensure_future(storage.list_bikes())
+        await asyncio.sleep(0.05)
+        assert not call.done()
+        # The only storage thread is free while the build is pending
+        assert await asyncio.get_running_loop().run_in_executor(executor, lambda: 'free') == 'free'
+        factory.release.set()
+        return await call
+
+    assert asyncio.run(main()) == ['bike']
+    executor.shutdown()
+
+
+def test_profile_reports_marks_in_order():
+    profile = StartupProfile()
+    assert profile.mark('imports')
+    assert not profile.mark('imports')
+    with profile.phase('build_users'):
+        pass
+    profile.mark('first_update')
+    lines = profile.report().splitlines()
+    assert lines[0] == "Startup profile"
+    assert lines[1].startswith("imports:") and lines[2].startswith("first_update:")
+    assert lines[3].startswith("build_users: took")
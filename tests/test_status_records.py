@@ -0,0 +1,77 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from storage import IndexedReservationStorage, ReservationStorage
+
+START = datetime(2030, 1, 1, 10)
+
+
+def add(storage, user_id, hours, status='accepted'):
+    start = START + timedelta(hours=hours)
+    return storage.add_reservation(user_id, 'u', 'f', 'l', 'a', 'e', 1, start, start + timedelta(hours=1), status)
+
+
+def count_rows(filename):
+    with open(filename) as f:
+        return sum(1 for _ in f) - 1
+
+
+@pytest.mark.parametrize('cls', [ReservationStorage, IndexedReservationStorage])
+def test_status_changes_are_appended_and_the_last_record_wins(tmp_path, cls):
+    filename = str(tmp_path / 'reservations.csv')
+    storage = cls(filename)
+    first = add(storage, 1, 0)
+    second = add(storage, 1, 1)
+    inode = os.stat(filename).st_ino
+    storage.update_statuses({first: 'active'})
+    storage.update_statuses({first: 'completed', second: 'accepted'})
+    # Unchanged statuses are not written
+    assert count_rows(filename) == 4
+    assert os.stat(filename).st_ino == inode
+    assert storage.get_reservation_by_id(first)['status'] == 'completed'
+    assert [(r['reservation_id'], r['status']) for r in storage.list_reservations_for_user_page(1, 10)[0]] == [(first, 'completed'), (second, 'accepted')]
+    for reservations in (storage.list_reservations(), storage.list_reservations_for_user(1), list(storage.iter_reservations())):
+        assert sorted((r['reservation_id'], r['status']) for r in reservations) == sorted([(first, 'completed'), (second, 'accepted')])
+
+
+def test_other_processes_apply_appended_status_records(tmp_path):
+    filename = str(tmp_path / 'reservations.csv')
+    writer = IndexedReservationStorage(filename)
+    reader = IndexedReservationStorage(filename)
+    reservation_id = add(writer, 1, 0)
+    assert reader.get_reservation_by_id(reservation_id)['status'] == 'accepted'
+    inode = reader._inode
+    writer.update_statuses({reservation_id: 'active'})
+    assert reader.get_reservation_by_id(reservation_id)['status'] == 'active'
+    assert [r['status'] for r in reader.list_reservations_for_user(1)] == ['active']
+    # Read from the tail, without reloading the whole file
+    assert reader._inode == inode
+
+
+@pytest.mark.parametrize('cls', [ReservationStorage, IndexedReservationStorage])
+def test_compaction_drops_superseded_records(tmp_path, cls):
+    filename = str(tmp_path / 'reservations.csv')
+    storage = cls(filename, compact_threshold=3)
+    ids = [add(storage, 1, hours) for hours in range(3)]
+    storage.update_statuses({ids[0]: 'active', ids[1]: 'active'})
+    assert count_rows(filename) == 5
+    storage.update_statuses({ids[0]: 'completed'})
+    assert count_rows(filename) == 3
+    assert {r['reservation_id']: r['status'] for r in storage.list_reservations()} == {ids[0]: 'completed', ids[1]: 'active', ids[2]: 'accepted'}
+
+
+@pytest.mark.parametrize('cls', [ReservationStorage, IndexedReservationStorage])
+def test_archiving_waits_for_the_archive_interval(tmp_path, cls):
+    storage = cls(str(tmp_path / 'reservations.csv'))
+    old = add(storage, 1, 0)
+    current = add(storage, 1, 24 * 60)
+    archive_before = START + timedelta(days=7)
+    storage.update_statuses({}, archive_before)
+    storage.update_statuses({old: 'completed'}, archive_before + timedelta(hours=1))
+    # Archived at the next compaction, once a day later
+    assert len(storage.list_reservations()) == 2
+    storage.update_statuses({}, archive_before + timedelta(days=1))
+    assert [r['reservation_id'] for r in storage.list_reservations()] == [current]
+    assert storage.get_reservation_by_id(old)['status'] == 'completed'
@@ -0,0 +1,42 @@
+import asyncio
+
+from telegram import Update
+
+from updates import PerUserUpdateProcessor
+
+
+def message_update(update_id:int, user_id:int):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+    return Update.de_json({'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'from': user, 'text': 'hi'}}, None)
+
+
+def run(updates):
+    """Process (update, seconds) pairs in order, returning the start and end events."""
+    events = []
+
+    async def handle(update, seconds):
+        events.append(('start', update.update_id))
+        await asyncio.sleep(seconds)
+        events.append(('end', update.update_id))
+
+    async def main():
+        processor = PerUserUpdateProcessor(8)
+        tasks = [asyncio.create_task(processor.process_update(update, handle(update, seconds))) for update, seconds in updates]
+        await asyncio.gather(*tasks)
+        return processor
+
+    processor = asyncio.run(main())
+    assert processor._locks == {}
+    return events
+
+
+def test_updates_of_one_user_run_in_order():
+    events = run([(message_update(1, 10), 0.03), (message_update(2, 10), 0.01), (message_update(3, 10), 0)])
+    assert events == [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 3), ('end', 3)]
+
+
+def test_other_users_do_not_wait():
+    events = run([(message_update(1, 10), 0.05), (message_update(2, 10), 0), (message_update(3, 20), 0)])
+    # User 20 is done while user 10's first update is still being handled
+    assert events.index(('end', 3)) < events.index(('end', 1))
+    assert events.index(('end', 1)) < events.index(('start', 2))
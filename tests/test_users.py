@@ -0,0 +1,64 @@
+import csv
+
+from storage import USER_FIELDS, UserStorage
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_last_record_wins(tmp_path):
+    users = UserStorage(str(tmp_path / 'users.csv'), compact_threshold=0)
+    users.add_user(1, 'ann', 'Ann', 'A', 'Rowing', 'ann@example.org')
+    users.add_user(2, 'bob', 'Bob', 'B', 'Chess', 'bob@example.org')
+    users.update_user(1, 'ann', 'Ann', 'A', 'Sailing', 'ann@example.com')
+    assert users.get_user_by_id(1)['association'] == 'Sailing'
+    assert users.get_user_by_id(1)['email'] == 'ann@example.com'
+    assert users.get_user_by_id(3) is None
+    assert sorted(user['user_id'] for user in users.list_users()) == [1, 2]
+    # Every write is a journal record until the file is compacted
+    assert len(read_rows(tmp_path / 'users.csv')) == 4
+
+
+def test_update_user_adds_new_users(tmp_path):
+    users = UserStorage(str(tmp_path / 'users.csv'))
+    users.update_user(7, 'eve', 'Eve', 'E', 'Rowing', 'eve@example.org')
+    assert users.get_user_by_id(7)['username'] == 'eve'
+
+
+def test_compaction_keeps_the_latest_records(tmp_path):
+    filename = str(tmp_path / 'users.csv')
+    users = UserStorage(filename, compact_threshold=3)
+    users.add_user(1, 'ann', 'Ann', 'A', 'Rowing', 'ann@example.org')
+    users.update_user(1, 'ann', 'Ann', 'A', 'Sailing', 'ann@example.org')
+    users.add_user(2, 'bob', 'Bob', 'B', 'Chess', 'bob@example.org')
+    assert read_rows(filename) == [USER_FIELDS, ['1', 'ann', 'Ann', 'A', 'Sailing', 'ann@example.org'], ['2', 'bob', 'Bob', 'B', 'Chess', 'bob@example.org']]
+    users.update_user(2, 'bob', 'Bob', 'B', 'Go', 'bob@example.org')
+    assert len(read_rows(filename)) == 4
+    assert users.get_user_by_id(2)['association'] == 'Go'
+
+
+def test_legacy_header_is_read_and_compacted(tmp_path):
+    filename = str(tmp_path / 'users.csv')
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user_id', 'username', 'first_name', 'last_name', 'association_name', 'email'])
+        writer.writerow([1, 'ann', 'Ann', 'A', 'Rowing', 'ann@example.org'])
+    users = UserStorage(filename, compact_threshold=2)
+    assert users.get_user_by_id(1)['association'] == 'Rowing'
+    users.add_user(2, 'bob', 'Bob', 'B', 'Chess', 'bob@example.org')
+    users.update_user(1, 'ann', 'Ann', 'A', 'Sailing', 'ann@example.org')
+    assert read_rows(filename)[0] == USER_FIELDS
+    assert {user['user_id']: user['association'] for user in users.list_users()} == {1: 'Sailing', 2: 'Chess'}
+
+
+def test_failed_compaction_does_not_fail_the_write(tmp_path, monkeypatch):
+    users = UserStorage(str(tmp_path / 'users.csv'), compact_threshold=1)
+
+    def broken_compact():
+        raise KeyError('association')
+
+    monkeypatch.setattr(users, '_compact', broken_compact)
+    users.add_user(1, 'ann', 'Ann', 'A', 'Rowing', 'ann@example.org')
+    assert users.get_user_by_id(1)['association'] == 'Rowing'
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+import pytest
+
+from webhook import MAX_BODY_SIZE, WebhookServer
+
+
+class RecordingServer(WebhookServer):
+    def __init__(self, **kwargs):
+        super().__init__(None, '127.0.0.1', 0, 'telegram', **kwargs)
+        self.delivered = []
+
+    def _deliver(self, payload, body):
+        if payload.get('explode'):
+            raise RuntimeError("handler bug")
+        payload['message']  # like Update.de_json, fails on a payload that is not a dict
+        self.delivered.append(payload)
+
+
+async def exchange(server, *requests):
+    """Send raw requests on one connection and return the status codes answered."""
+    port = server._server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    statuses = []
+    for request in requests:
+        writer.write(request)
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            break
+        statuses.append(int(line.split()[1]))
+        await reader.readuntil(b'\r\n\r\n')
+    writer.close()
+    return statuses
+
+
+def post(body:bytes, headers:str=''):
+    return f"POST /telegram HTTP/1.1\r\nContent-Length: {len(body)}\r\n{headers}\r\n".encode() + body
+
+
+def chunked(*chunks:bytes):
+    body = b''.join(f"{len(chunk):x}\r\n".encode() + chunk + b'\r\n' for chunk in chunks)
+    return b"POST /telegram HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n" + body + b"0\r\n\r\n"
+
+
+def run(server, *requests):
+    async def main():
+        await server.start()
+        try:
+            return await exchange(server, *requests)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_plain_and_chunked_bodies_are_delivered():
+    server = RecordingServer()
+    update = json.dumps({'update_id': 1, 'message': {}}).encode()
+    assert run(server, post(update), chunked(update[:5], update[5:])) == [200, 200]
+    assert [p['update_id'] for p in server.delivered] == [1, 1]
+
+
+@pytest.mark.parametrize('body', [b'not json', b'[1, 2]', b'{"update_id": 1}'])
+def test_malformed_updates_get_400_and_keep_the_connection(body):
+    server = RecordingServer()
+    assert run(server, post(body), post(b'{"message": {}}')) == [400, 200]
+
+
+def test_delivery_errors_get_500():
+    server = RecordingServer()
+    assert run(server, post(b'{"explode": true}'), post(b'{"message": {}}')) == [500, 200]
+
+
+def test_malformed_requests_get_400():
+    assert run(RecordingServer(), b"GARBAGE\r\n\r\n") == [400]
+    assert run(RecordingServer(), b"POST /telegram HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n") == [400]
+
+
+def test_limits_path_method_and_secret():
+    server = RecordingServer(secret_token='s3cr3t')
+    body = b'{"message": {}}'
+    statuses = run(
+        server,
+        b"POST /other HTTP/1.1\r\nContent-Length: 0\r\n\r\n",
+        b"GET /telegram HTTP/1.1\r\nContent-Length: 0\r\n\r\n",
+        post(body),
+        post(body, 'X-Telegram-Bot-Api-Secret-Token: s3cr3t\r\n'),
+        f"POST /telegram HTTP/1.1\r\nContent-Length: {MAX_BODY_SIZE + 1}\r\n\r\n".encode(),
+    )
+    assert statuses == [404, 405, 403, 200, 413]
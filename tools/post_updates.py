@@ -0,0 +1,40 @@
+"""POST recorded Telegram updates to a local webhook listener.
+
+The input file holds either one JSON update, a JSON list of updates, or one update
+per line (JSON Lines).
+
+Usage:
+    python tools/post_updates.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret s3cr3t
+"""
+import argparse
+import json
+import urllib.request
+
+
+def load_updates(filename):
+    with open(filename) as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file', help="recorded updates")
+    parser.add_argument('--url', default='http://127.0.0.1:8443/telegram')
+    parser.add_argument('--secret', help="value of WEBHOOK_SECRET, if set")
+    args = parser.parse_args()
+
+    for update in load_updates(args.file):
+        request = urllib.request.Request(args.url, data=json.dumps(update).encode(), method='POST', headers={'Content-Type': 'application/json'})
+        if args.secret:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', args.secret)
+        with urllib.request.urlopen(request) as response:
+            print(update.get('update_id'), response.status)
+
+
+if __name__ == '__main__':
+    main()